@@ -16,13 +16,19 @@
 #    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
 ####################################################################################################
 import argparse
+import threading
 import time
 import yarp
-from pyNAO.nao import Nao
+from pyNAO              import backend
+from pyNAO.metrics      import METRICS
+from pyNAO.proxy_pool   import POOL
 
 EMSG_YARP_NOT_FOUND  = "Could not connect to the yarp server. Try running 'yarp detect'."
 EMSG_ROBOT_NOT_FOUND = 'Could not connect to the robot at %s:%s'
 
+# --init choice -> initialize argument of Nao
+INIT_MODES           = { 'sync': True, 'async': 'async', 'none': False }
+
 
 class BaseModule(yarp.RFModule):
     """ The BaseModule class provides a base class for developing modules for the Nao robot.
@@ -35,24 +41,52 @@ class BaseModule(yarp.RFModule):
 
     def __init__(self, ip, port, prefix):
         yarp.RFModule.__init__(self)
-        self.ip     = ip
-        self.port   = int(port)
-        self.prefix = prefix
+        self.ip           = ip
+        self.port         = int(port)
+        self.prefix       = prefix
+        self.moduleName   = self.__class__.__name__
+        self.nao          = None
+        self.init         = 'sync'
+        self.stateRate    = 0.0
+        self.state_port   = None
+        self.sampler      = None
+        self.metricsRate  = 0.0
+        self.metrics_port = None
+        self._lastMetrics = 0.0
+
+
+    @staticmethod
+    def addArguments(parser):
+        """ This hook method adds module specific command line arguments to the \a parser.
+
+        @param parser - argparse.ArgumentParser object
+        """
+        pass
+
+
+    def applyArguments(self, args):
+        """ This hook method gets called with the parsed command line arguments before the module is
+            configured.
+
+        @param args - argparse.Namespace object
+        """
+        self.stateRate = args.state_rate
+        self.init      = args.init
+
+        # metrics need to be enabled before the proxies get created
+        self.metricsRate = args.metrics_rate
+        if args.metrics or self.metricsRate > 0:
+            METRICS.enabled = True
 
 
     def configure(self, rf):
 
-        name = self.__class__.__name__ 
+        name = self.moduleName
         if self.prefix:
             name = self.prefix + '/' + name
 
         self.setName(name)
 
-        try:
-            self.nao = Nao(self.ip, self.port)
-        except:
-            raise RuntimeError(EMSG_ROBOT_NOT_FOUND % (self.ip, self.port))
-
         # RPC Port
         self.rpc_port = yarp.RpcServer()
 
@@ -64,16 +98,123 @@ class BaseModule(yarp.RFModule):
 
         self.attach_rpc_server(self.rpc_port)
 
+        # connect after opening the port, so clients can find the module while it starts; the port
+        # must not outlive a failed start
+        try:
+            self.connect()
+        except:
+            self.rpc_port.close()
+            raise
+
+        # optional robot state port
+        if self.stateRate > 0 and self.nao is not None:
+            self.state_port = yarp.BufferedPortBottle()
+            if not self.state_port.open('/%s/%s' % (name, 'state:o')):
+                raise RuntimeError, EMSG_YARP_NOT_FOUND
+
+            self.sampler = self.nao.startStateSampler(self.stateRate)
+            self.sampler.listeners.append(self.publishState)
+
+        # optional metrics port
+        if self.metricsRate > 0:
+            self.metrics_port = yarp.BufferedPortBottle()
+            if not self.metrics_port.open('/%s/%s' % (name, 'metrics:o')):
+                raise RuntimeError, EMSG_YARP_NOT_FOUND
+
         return True
 
 
+    def respond(self, command, reply):
+        """ This is the respond hook method which gets called upon receiving a bottle via RPC port.
+            It handles the 'stats' command and leaves everything else to the yarp module.
+
+        @param command - input bottle
+        @param reply - output bottle
+        @return boolean
+        """
+        if command.get(0).toString() == 'stats':
+            reply.addString('ack')
+            self.addStats(reply)
+            return True
+
+        return yarp.RFModule.respond(self, command, reply)
+
+
+    @staticmethod
+    def addStats(bottle):
+        """ This method adds the current metrics to \a bottle as (<name> <count>) entries for the
+            counters and (<name> <count> <mean> <p50> <p99> <max>) entries in milliseconds for the
+            timers.
+
+        @param bottle - yarp.Bottle
+        """
+        snapshot = METRICS.snapshot()
+
+        for name, count in sorted(snapshot['counters'].items()):
+            entry = bottle.addList()
+            entry.addString(name)
+            entry.addInt(count)
+
+        for name, values in sorted(snapshot['histograms'].items()):
+            entry = bottle.addList()
+            entry.addString(name)
+            entry.addInt(values['count'])
+            for key in ('mean', 'p50', 'p99', 'max'):
+                entry.addDouble(values[key] * 1000.0)
+
+
+    def publishState(self, state):
+        """ This method writes a robot state to the state port as bottle
+            (<timestamp> (<angles>) (<stiffnesses>) (<effector> x y z wx wy wz) ...).
+
+        @param state - RobotState
+        """
+        bottle = self.state_port.prepare()
+        bottle.clear()
+        bottle.addDouble(state.timestamp)
+
+        for values in (state.angles, state.stiffnesses):
+            sub = bottle.addList()
+            for value in values:
+                sub.addDouble(value)
+
+        for effector in sorted(state.positions):
+            sub = bottle.addList()
+            sub.addString(effector)
+            for value in state.positions[effector]:
+                sub.addDouble(value)
+
+        self.state_port.write()
+
+
+    def connect(self):
+        """ This hook method creates the connection to the robot. """
+        # imported here, so modules that do not need a robot start without loading it
+        from pyNAO.nao import Nao
+
+        try:
+            self.nao = Nao.get(self.ip, self.port, INIT_MODES[self.init])
+        except:
+            raise RuntimeError(EMSG_ROBOT_NOT_FOUND % (self.ip, self.port))
+
+
     def interruptModule(self):
         self.rpc_port.interrupt()
+        if self.state_port is not None:
+            self.state_port.interrupt()
+        if self.metrics_port is not None:
+            self.metrics_port.interrupt()
         return True
 
 
     def close(self):
         self.rpc_port.close()
+        if self.state_port is not None:
+            if self.sampler is not None and self.publishState in self.sampler.listeners:
+                self.sampler.listeners.remove(self.publishState)
+            self.state_port.close()
+        if self.metrics_port is not None:
+            self.metrics_port.close()
         return True
 
 
@@ -82,6 +223,17 @@ class BaseModule(yarp.RFModule):
 
 
     def updateModule(self):
+        # reconnect broken proxies; the pool limits how often this actually checks
+        POOL.checkAll()
+
+        now = time.time()
+        if self.metrics_port is not None and now - self._lastMetrics >= 1.0 / self.metricsRate:
+            self._lastMetrics = now
+            bottle = self.metrics_port.prepare()
+            bottle.clear()
+            self.addStats(bottle)
+            self.metrics_port.write()
+
         # XXX: I do not know why we need that, but if method is empty the module gets stuck
         time.sleep(0.000001)
         return True
@@ -92,9 +244,10 @@ class BaseModule(yarp.RFModule):
 # Default methods for running the modules standalone 
 #
 ####################################################################################################
-def createArgParser():
+def createArgParser(*module_classes):
     """ This method creates a base argument parser. 
     
+    @param module_classes - BaseModule based classes that can add their own arguments
     @return Argument Parser object
     """
     parser = argparse.ArgumentParser(description='Create a NaoModule to control the Nao robot.')
@@ -110,16 +263,52 @@ def createArgParser():
                          dest       = 'name', 
                          default    = '',
                          help       = 'Name prefix for Yarp port names')
+    parser.add_argument( '--backend', 
+                         dest       = 'backend', 
+                         default    = None,
+                         choices    = backend.BACKENDS,
+                         help       = 'Robot backend (default: $PYNAO_BACKEND or naoqi)')
+    parser.add_argument( '--init', 
+                         dest       = 'init', 
+                         default    = 'sync',
+                         choices    = sorted(INIT_MODES),
+                         help       = 'Initialize the robot (stiffness and StandInit posture) ' \
+                                      'before the module starts, in the background or not at ' \
+                                      'all (default: sync)')
+    parser.add_argument( '--state-rate', 
+                         dest       = 'state_rate', 
+                         default    = 0.0,
+                         type       = float,
+                         help       = 'Rate in Hz for sampling the robot state and publishing ' \
+                                      'it on /<name>/<module>/state:o (default: 0 = off)')
+    parser.add_argument( '--metrics', 
+                         dest       = 'metrics', 
+                         action     = 'store_true',
+                         help       = 'Collect latency and throughput metrics (RPC command: stats)')
+    parser.add_argument( '--metrics-rate', 
+                         dest       = 'metrics_rate', 
+                         default    = 0.0,
+                         type       = float,
+                         help       = 'Rate in Hz for publishing the metrics on ' \
+                                      '/<name>/<module>/metrics:o; implies --metrics ' \
+                                      '(default: 0 = off)')
+
+    for module_cls in module_classes:
+        module_cls.addArguments(parser)
 
     return parser.parse_args()
 
 
-def main(module_cls):
-    """ This is a main method to run a module from command line. 
+def main(*module_classes):
+    """ This is a main method to run one or more modules from command line. Several modules are 
+        hosted in one process and share the connection to the robot.
 
-    @param module_cls - an BaseModule based class that can be started as a standalone module.
+    @param module_classes - BaseModule based classes that can be started as standalone modules.
     """
-    args = createArgParser()
+    args = createArgParser(*module_classes)
+
+    if args.backend:
+        backend.use(args.backend)
 
     yarp.Network.init()
 
@@ -128,8 +317,25 @@ def main(module_cls):
 
     # resource_finder.configure(argc,argv);
 
-    module = module_cls(args.ip, args.port, args.name)
-    module.configure(resource_finder)
-    module.runModule(resource_finder)
+    modules = []
+    for module_cls in module_classes:
+        module = module_cls(args.ip, args.port, args.name)
+        module.applyArguments(args)
+        module.configure(resource_finder)
+        modules.append(module)
+
+    # the first module runs in the main thread, the others in their own threads
+    threads = [ threading.Thread(target = module.runModule, args = (resource_finder,))
+                for module in modules[1:] ]
+
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    modules[0].runModule(resource_finder)
+
+    for module, thread in zip(modules[1:], threads):
+        module.stopModule()
+        thread.join()
 
     yarp.Network.fini()
@@ -0,0 +1,189 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+""" An event loop client for the Nao robot. pyNAO runs on Python 2, so the module uses trollius,
+    the Python 2 port of asyncio (pip install pyNAO[async]), e.g.:
+
+    @trollius.coroutine
+    def behave(nao):
+        yield From(nao.look([1.0, 0.5, 0.0]))
+        position = yield From(nao.getPosition('LArm'))
+"""
+import trollius as asyncio
+
+from pyNAO.motion_queue import MotionHandle
+from pyNAO.nao          import Nao
+
+
+class AsyncNao(object):
+    """ The AsyncNao class wraps a Nao object for use from an event loop. Proxy calls run in an
+        executor and motions return futures that are resolved when the motion is finished, without
+        a thread per pending motion. Cancelling a motion future cancels the motion.
+    """
+
+    def __init__(self, nao, loop = None, executor = None):
+        """
+        @param nao      - Nao object
+        @param loop     - event loop (default: asyncio.get_event_loop())
+        @param executor - concurrent.futures executor for the proxy calls (default: the default
+                          executor of the loop)
+        """
+        self.nao      = nao
+        self.loop     = loop or asyncio.get_event_loop()
+        self.executor = executor
+
+
+    @classmethod
+    def connect(cls, ip, port, loop = None, executor = None, initialize = True):
+        """ This method connects to the robot at \a ip and \a port in the executor.
+
+        @param ip         - string specifying the IP address of the robot
+        @param port       - integer specifying the port of the robot
+        @param loop       - event loop (default: asyncio.get_event_loop())
+        @param executor   - executor for the proxy calls (default: the default executor)
+        @param initialize - True, 'async' or False, see Nao.__init__ (default: True)
+        @return future of the AsyncNao object
+        """
+        loop   = loop or asyncio.get_event_loop()
+        future = loop.run_in_executor(executor, Nao.get, ip, port, initialize)
+        return _chain(loop, future, lambda nao: cls(nao, loop, executor))
+
+
+    def call(self, func, *args):
+        """ This method calls \a func with \a args in the executor.
+
+        @return future of the return value
+        """
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+
+    def wrap(self, handle):
+        """ This method returns a future that is resolved once the motion of \a handle is finished.
+            Its result is the return value of the motion function; a cancelled motion cancels the
+            future and vice versa.
+
+        @param handle - MotionHandle
+        @return future
+        """
+        future = asyncio.Future(loop = self.loop)
+
+        def onMotionDone(handle):
+            self.loop.call_soon_threadsafe(self._resolve, future, handle)
+
+        def onFutureDone(future):
+            if future.cancelled():
+                handle.cancel()
+
+        future.add_done_callback(onFutureDone)
+        handle.addDoneCallback(onMotionDone)
+        return future
+
+
+    @staticmethod
+    def _resolve(future, handle):
+        if future.done():
+            return
+
+        if handle.state == MotionHandle.CANCELLED:
+            future.cancel()
+        elif handle.state == MotionHandle.FAILED:
+            future.set_exception(handle._error or RuntimeError('Motion failed'))
+        else:
+            future.set_result(handle._result)
+
+
+    ################################################################################################
+    # motions: submitting a motion does not block, so only the completion is awaited
+    ################################################################################################
+    def look(self, vector):
+        """ @return future that is resolved when the head motion is finished, see Nao.look """
+        return self.wrap(self.nao.look(vector))
+
+
+    def point(self, arm, vector):
+        """ @return future that is resolved when the arm motion is finished, see Nao.point """
+        return self.wrap(self.nao.point(arm, vector))
+
+
+    def plan(self, actions):
+        """ @return future that is resolved when all actions are finished, see Nao.plan """
+        return self.wrap(self.nao.plan(actions))
+
+
+    def stop(self):
+        """ This method cancels all pending and running motions and halts the robot in the
+            executor; the futures of the motions get cancelled.
+
+        @return future that is resolved when the robot is halted
+        """
+        return self.call(self.nao.stop)
+
+
+    ################################################################################################
+    # proxy calls
+    ################################################################################################
+    def openHand(self, arm):
+        return self.call(self.nao.openHand, arm)
+
+
+    def closeHand(self, arm):
+        return self.call(self.nao.closeHand, arm)
+
+
+    def goToPosture(self, posture, speed = 0.2):
+        """ @return future that is True if the posture was reached, see Nao.goToPosture """
+        return self.call(self.nao.goToPosture, posture, speed)
+
+
+    def setStiffness(self, value):
+        """ @return future that is resolved when the stiffness is set, see Nao.setStiffness """
+        return self.call(self.nao.setStiffness, value)
+
+
+    def getPosition(self, joint, maxAge = None):
+        """ @return future of the position, see Nao.getPosition """
+        return self.call(self.nao.getPosition, joint, maxAge)
+
+
+    def startVision(self, *args, **kwargs):
+        """ @return future of the video client handle, see Nao.startVision """
+        return self.call(lambda: self.nao.startVision(*args, **kwargs))
+
+
+    def stopVision(self, client = None):
+        return self.call(self.nao.stopVision, client)
+
+
+    def getImage(self, client = None):
+        """ @return future of the image, see Nao.getImage """
+        return self.call(self.nao.getImage, client)
+
+
+def _chain(loop, future, func):
+    """ This method returns a future of \a func applied to the result of \a future. """
+    result = asyncio.Future(loop = loop)
+
+    def onDone(future):
+        if future.cancelled():
+            result.cancel()
+        elif future.exception() is not None:
+            result.set_exception(future.exception())
+        else:
+            result.set_result(func(future.result()))
+
+    future.add_done_callback(onDone)
+    return result
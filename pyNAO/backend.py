@@ -0,0 +1,74 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+# Selects the robot backend by the environment variable PYNAO_BACKEND or by use():
+#
+#   naoqi - the NAOqi SDK (default)
+#   fake  - the in-process stand-in of pyNAO.fake_naoqi, for testing without a robot
+#
+# Only the constant modules are imported here. The proxy implementation (the naoqi module, which
+# loads the NAOqi libraries) is imported when the first proxy gets created.
+#
+import os
+
+from pyNAO import fake_naoqi
+
+BACKENDS = ['naoqi', 'fake']
+NAME     = None
+
+# the constants of the stand-in mirror the ones of the SDK, so they can be used if the SDK is not
+# installed, e.g. when the fake backend is only selected on the command line
+try:
+    import motion
+    import vision_definitions
+except ImportError:
+    motion             = fake_naoqi.motion
+    vision_definitions = fake_naoqi.vision_definitions
+
+_factory = None
+
+
+def use(name):
+    """ This method selects the backend. It needs to be called before the first proxy gets created.
+
+    @param name - string specifying the backend, 'naoqi' or 'fake'
+    """
+    global NAME, _factory
+
+    if name not in BACKENDS:
+        raise ImportError("Unknown PYNAO_BACKEND '%s', use 'naoqi' or 'fake'" % name)
+
+    NAME     = name
+    _factory = None
+
+
+def ALProxy(service, ip, port):
+    """ This method creates a proxy to \a service of the robot at \a ip and \a port with the
+        selected backend.
+    """
+    global _factory
+
+    if _factory is None:
+        if NAME == 'fake':
+            _factory = fake_naoqi.ALProxy
+        else:
+            from naoqi import ALProxy as _factory
+
+    return _factory(service, ip, port)
+
+
+use(os.environ.get('PYNAO_BACKEND', 'naoqi'))
@@ -0,0 +1,266 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+
+import numpy as np
+
+from pyNAO              import backend
+from pyNAO.fake_naoqi   import FakeRobot
+from pyNAO.nao          import Nao
+
+try:
+    import yarp
+except ImportError:
+    yarp = None
+
+
+IP   = '127.0.0.1'
+PORT = 9559
+
+
+def measure(func, repeat = 1000, warmup = 10):
+    """ This method calls \a func \a repeat times and returns timing statistics.
+
+    @param func   - callable without arguments
+    @param repeat - integer specifying the number of measured calls (default: 1000)
+    @param warmup - integer specifying the number of calls before measuring (default: 10)
+    @return dictionary with ops_per_s, mean_us, p50_us and p99_us
+    """
+    for _ in range(warmup):
+        func()
+
+    timer   = timeit.default_timer
+    samples = np.empty(repeat)
+    for i in range(repeat):
+        start      = timer()
+        func()
+        samples[i] = timer() - start
+
+    return { 'ops_per_s': float(repeat / samples.sum()),
+             'mean_us':   float(samples.mean()      * 1e6),
+             'p50_us':    float(np.percentile(samples, 50) * 1e6),
+             'p99_us':    float(np.percentile(samples, 99) * 1e6) }
+
+
+def benchKinematics(nao, results):
+    vectors = np.random.RandomState(0).uniform([0.3, -1.0, -0.5], [2.0, 1.0, 1.0], (500, 3))
+    offset  = Nao.OFFSET['LShoulder']
+
+    results['kinematics.getPitchAndYaw']    = measure(lambda: [ nao.getPitchAndYaw(v)
+                                                                for v in vectors ], 20)
+    results['kinematics.getPitchesAndYaws'] = measure(lambda: nao.getPitchesAndYaws(vectors), 20)
+    results['kinematics.getTarget']         = measure(lambda: [ nao.getTarget(v, offset)
+                                                                for v in vectors ], 20)
+    results['kinematics.getTargets']        = measure(lambda: nao.getTargets(vectors, Nao.LArm), 20)
+
+
+def createController(nao):
+    """ This method creates a NaoController for \a nao that can respond without yarp ports.
+
+    @param nao - Nao object
+    @return NaoController
+    """
+    from pyNAO.nao_controller     import NaoController
+    from pyNAO.command_dispatcher import CommandDispatcher
+
+    controller            = NaoController(IP, PORT, '')
+    controller.nao        = nao
+    controller.dispatcher = CommandDispatcher()
+    return controller
+
+
+def benchRespond(nao, results):
+    controller = createController(nao)
+
+    for text in ('look 1.0 0.5 0.0', 'point left 1.0 0.5 0.0', 'status 1'):
+        command = yarp.Bottle()
+        command.fromString(text)
+
+        def respond():
+            reply = yarp.Bottle()
+            controller.respond(command, reply)
+
+        results['respond.%s' % text.split()[0]] = measure(respond, 2000)
+
+    controller.dispatcher.shutdown()
+    nao.stop()
+
+
+def benchVideo(nao, results):
+    from pyNAO.nao_video    import CameraStream, ImageBufferRing
+    from pyNAO.frame_codec  import encodeFrame
+
+    for resolution in ('qvga', 'vga'):
+        width, height = Nao.RESOLUTIONS[resolution][1:]
+
+        for colorspace in ('rgb', 'yuv422'):
+            layers = Nao.COLORSPACES[colorspace][1]
+            data   = np.random.RandomState(0).randint(0, 256, height * width * layers) \
+                                             .astype(np.uint8).tostring()
+            ring   = ImageBufferRing(width, height, colorspace = colorspace)
+            name   = 'video.fill.%s.%s' % (resolution, colorspace)
+            results[name] = measure(lambda: ring.fill(data), 200)
+
+        array = ring.next()[1]
+        results['video.encode.%s.jpeg' % resolution] = measure(lambda: encodeFrame(array), 50)
+
+        # fetch and publish of NaoVideo; the ports are not opened, so nothing leaves the process
+        stream             = CameraStream('top', resolution)
+        stream.bufRing     = ImageBufferRing(width, height)
+        stream.imgOutPort  = yarp.Port()
+        stream.metaOutPort = yarp.BufferedPortBottle()
+        stream.nao         = nao
+        stream.client      = nao.startVision(stream.camera, resolution, stream.colorspace,
+                                             stream.fps, 'benchmark')
+        seq                = { 'value': 0 }
+
+        def publish():
+            seq['value'] += 1
+            stream.publish(seq['value'], stream.fetch())
+
+        results['video.publish.%s' % resolution] = measure(publish, 200)
+        nao.stopVision(stream.client)
+
+
+def benchLatency(nao, results):
+    """ This method measures the time from a look command arriving at the RPC respond of
+        NaoController until the simulated head receives the command.
+    """
+    controller = createController(nao)
+    robot      = FakeRobot.get(IP, PORT)
+    commands   = []
+    for text in ('look 1.0 0.5 0.0', 'look 1.0 -0.5 0.0'):
+        commands.append(yarp.Bottle())
+        commands[-1].fromString(text)
+    state      = { 'index': 0 }
+
+    def look():
+        state['index'] ^= 1
+        before = robot.target['HeadYaw']
+        controller.respond(commands[state['index']], yarp.Bottle())
+        while robot.target['HeadYaw'] is before:
+            time.sleep(0.0001)
+
+    results['latency.look'] = measure(look, 200)
+    controller.dispatcher.shutdown()
+    nao.stop()
+
+
+def run():
+    """ This method runs all benchmarks.
+
+    @return dictionary benchmark name -> statistics
+    """
+    results = {}
+
+    nao = Nao.get(IP, PORT)
+    benchKinematics(nao, results)
+
+    if yarp is None:
+        print 'yarp not found: skipping the respond, video and latency benchmarks'
+    else:
+        benchRespond(nao, results)
+        benchVideo(nao, results)
+        benchLatency(nao, results)
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ This method compares the throughput of \a results against \a baseline.
+
+    @param results   - dictionary benchmark name -> statistics
+    @param baseline  - dictionary benchmark name -> statistics
+    @param threshold - float specifying the tolerated relative slowdown
+    @return list of (name, relative change) of the regressions
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+
+        change = results[name]['ops_per_s'] / baseline[name]['ops_per_s'] - 1.0
+        print '%-40s %+7.1f%%' % (name, change * 100.0)
+        if change < -threshold:
+            regressions.append((name, change))
+
+    return regressions
+
+
+def gitRevision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd = os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return None
+
+
+def createArgParser():
+    """ This method creates the argument parser of the benchmark.
+
+    @return Argument Parser object
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the pyNAO hot paths.')
+    parser.add_argument( '-o', '--output',
+                         dest       = 'output',
+                         default    = None,
+                         help       = 'Write the results as JSON to this file.')
+    parser.add_argument( '-c', '--compare',
+                         dest       = 'compare',
+                         default    = None,
+                         help       = 'Compare against the results in this JSON file.')
+    parser.add_argument( '-t', '--threshold',
+                         dest       = 'threshold',
+                         default    = 0.2,
+                         type       = float,
+                         help       = 'Tolerated relative throughput loss (default: 0.2)')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args    = createArgParser()
+
+    # the benchmarks always run against the in-process stand-in backend
+    backend.use('fake')
+    results = run()
+    report  = { 'revision': gitRevision(),
+                'python':   platform.python_version(),
+                'time':     time.time(),
+                'results':  results }
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent = 2, sort_keys = True)
+    else:
+        print json.dumps(report, indent = 2, sort_keys = True)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline)['results'], args.threshold)
+
+        if regressions:
+            print 'Regressions: %s' % ', '.join(name for name, _ in regressions)
+            sys.exit(1)
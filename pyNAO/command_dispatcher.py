@@ -0,0 +1,177 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+import collections
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+from pyNAO.metrics      import METRICS
+from pyNAO.motion_queue import MotionHandle
+
+
+class Request(object):
+    """ The Request class holds the state of a command submitted to a CommandDispatcher. """
+
+    QUEUED    = 'queued'
+    RUNNING   = 'running'
+    DONE      = 'done'
+    FAILED    = 'failed'
+    CANCELLED = 'cancelled'
+
+
+    def __init__(self, rid, name, func, priority):
+        self.id        = rid
+        self.name      = name
+        self.func      = func
+        self.priority  = priority
+        self.state     = Request.QUEUED
+        self.handle    = None
+        self.submitted = time.time()
+        self.finished  = None
+
+
+    @property
+    def duration(self):
+        """ @return seconds from submission until the request finished (or until now) """
+        return (self.finished or time.time()) - self.submitted
+
+
+    def cancel(self):
+        if self.handle is not None:
+            self.handle.cancel()
+        elif self.state == Request.QUEUED:
+            self._finish(Request.CANCELLED)
+
+
+    def _finish(self, state):
+        self.state    = state
+        self.finished = time.time()
+
+
+    def _onMotionDone(self, handle):
+        states = { MotionHandle.DONE:      Request.DONE,
+                   MotionHandle.CANCELLED: Request.CANCELLED }
+        self._finish(states.get(handle.state, Request.FAILED))
+
+
+class CommandDispatcher(object):
+    """ The CommandDispatcher class executes commands in a worker thread ordered by priority, so
+        that the caller (e.g. a yarp RPC callback) can return immediately.
+
+    A command function may return a MotionHandle; the request then stays running until the motion
+    is finished.
+    """
+
+    PRIORITY_HIGH   = 0
+    PRIORITY_NORMAL = 10
+
+    # number of finished requests kept for status queries
+    HISTORY         = 1000
+
+
+    def __init__(self):
+        self._heap     = []
+        self._requests = collections.OrderedDict()
+        self._ids      = itertools.count(1)
+        self._order    = itertools.count()
+        self._cond     = threading.Condition()
+        self._running  = True
+        self._thread   = threading.Thread(target = self._loop, name = 'CommandDispatcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def submit(self, name, func, priority = PRIORITY_NORMAL, preempt = False):
+        """ This method enqueues a command and returns immediately.
+
+        @param name     - string specifying the command name
+        @param func     - callable without arguments; may return a MotionHandle
+        @param priority - integer; lower values are executed first (default: PRIORITY_NORMAL)
+        @param preempt  - boolean; if True all queued and running requests get cancelled
+                          (default: False)
+        @return Request
+        """
+        with self._cond:
+            if preempt:
+                self._cancelAll()
+
+            request = Request(next(self._ids), name, func, priority)
+            self._requests[request.id] = request
+            heapq.heappush(self._heap, (priority, next(self._order), request))
+
+            # forget the oldest requests
+            while len(self._requests) > CommandDispatcher.HISTORY:
+                self._requests.popitem(last = False)
+
+            self._cond.notify()
+            return request
+
+
+    def status(self, rid):
+        """ This method returns the request with the id \a rid.
+
+        @param rid - integer specifying the request id
+        @return Request or None if the id is unknown
+        """
+        with self._cond:
+            return self._requests.get(rid)
+
+
+    def shutdown(self):
+        with self._cond:
+            self._running = False
+            self._cancelAll()
+            self._cond.notify()
+
+
+    def _cancelAll(self):
+        for request in self._requests.values():
+            if request.state in (Request.QUEUED, Request.RUNNING):
+                request.cancel()
+        del self._heap[:]
+
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while self._running and not self._heap:
+                    self._cond.wait()
+
+                if not self._running:
+                    return
+
+                request = heapq.heappop(self._heap)[2]
+                if request.state != Request.QUEUED:
+                    continue
+                request.state = Request.RUNNING
+
+            METRICS.observe('dispatch.queued', time.time() - request.submitted)
+            try:
+                result = request.func()
+            except Exception:
+                traceback.print_exc()
+                request._finish(Request.FAILED)
+                continue
+
+            if isinstance(result, MotionHandle):
+                request.handle = result
+                result.addDoneCallback(request._onMotionDone)
+            else:
+                request._finish(Request.DONE)
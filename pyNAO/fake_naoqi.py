@@ -0,0 +1,486 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+import itertools
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class motion(object):
+    """ Stand-in for the constants of the NAOqi motion module. """
+    FRAME_TORSO = 0
+    FRAME_WORLD = 1
+    FRAME_ROBOT = 2
+
+
+class vision_definitions(object):
+    """ Stand-in for the constants of the NAOqi vision_definitions module. """
+    kQQVGA            = 0
+    kQVGA             = 1
+    kVGA              = 2
+    k4VGA             = 3
+    kYuvColorSpace    = 0
+    kYUV422ColorSpace = 9
+    kRGBColorSpace    = 11
+    kBGRColorSpace    = 13
+
+
+class FakeTask(object):
+    """ The FakeTask class represents a motion task of a FakeRobot. """
+
+    def __init__(self, taskId):
+        self.id       = taskId
+        self.joints   = set()
+        self.stopped  = threading.Event()
+        self.finished = threading.Event()
+
+
+class FakeRobot(object):
+    """ The FakeRobot class simulates the joints and cameras of one robot. Joints move towards their
+        targets with a constant speed; the angles are evaluated lazily when they are read.
+    """
+
+    # added to every proxy call in seconds
+    LATENCY   = float(os.environ.get('PYNAO_FAKE_LATENCY', 0.0))
+
+    # maximum joint speed in rad/s
+    MAX_SPEED = 4.0
+
+    Joints    = [ 'HeadYaw', 'HeadPitch',
+                  'LShoulderPitch', 'LShoulderRoll', 'LElbowYaw', 'LElbowRoll', 'LWristYaw',
+                  'LHand',
+                  'LHipYawPitch', 'LHipRoll', 'LHipPitch', 'LKneePitch', 'LAnklePitch',
+                  'LAnkleRoll',
+                  'RHipYawPitch', 'RHipRoll', 'RHipPitch', 'RKneePitch', 'RAnklePitch',
+                  'RAnkleRoll',
+                  'RShoulderPitch', 'RShoulderRoll', 'RElbowYaw', 'RElbowRoll', 'RWristYaw',
+                  'RHand' ]
+
+    Chains    = { 'Head':     Joints[0:2],
+                  'LArm':     Joints[2:8],
+                  'LLeg':     Joints[8:14],
+                  'RLeg':     Joints[14:20],
+                  'RArm':     Joints[20:26],
+                  'Body':     Joints,
+                  'JointActuators': Joints }
+
+    Postures  = { 'StandInit': dict(zip(Joints, [ 0.0, 0.0,
+                                                  1.4, 0.3, -1.4, -1.0, 0.0, 0.3,
+                                                  0.0, 0.0, -0.45, 0.7, -0.35, 0.0,
+                                                  0.0, 0.0, -0.45, 0.7, -0.35, 0.0,
+                                                  1.4, -0.3, 1.4, 1.0, 0.0, 0.3 ])),
+                  'Crouch':    dict(zip(Joints, [ 0.0, 0.0,
+                                                  0.9, 0.1, -1.2, -0.5, 0.0, 0.3,
+                                                  0.0, 0.0, -0.9, 2.1, -1.2, 0.0,
+                                                  0.0, 0.0, -0.9, 2.1, -1.2, 0.0,
+                                                  0.9, -0.1, 1.2, 0.5, 0.0, 0.3 ])) }
+
+    _robots   = {}
+    _lock     = threading.Lock()
+
+
+    def __init__(self):
+        self.lock        = threading.RLock()
+        self.start       = dict( (joint, (0.0, 0.0)) for joint in FakeRobot.Joints )
+        self.target      = dict( (joint, (0.0, 1.0)) for joint in FakeRobot.Joints )
+        self.stiffness   = dict( (joint, 0.0)        for joint in FakeRobot.Joints )
+        self.positions   = {}
+        self.posture     = 'Unknown'
+        self.frames      = 0
+        self.tasks       = {}
+        self.taskIds     = itertools.count(1)
+        self._local      = threading.local()
+
+
+    @classmethod
+    def get(cls, ip, port):
+        """ @return the FakeRobot simulating the robot at \a ip and \a port """
+        with cls._lock:
+            if (ip, port) not in cls._robots:
+                cls._robots[(ip, port)] = cls()
+            return cls._robots[(ip, port)]
+
+
+    @staticmethod
+    def delay():
+        if FakeRobot.LATENCY > 0:
+            time.sleep(FakeRobot.LATENCY)
+
+
+    def names(self, names):
+        if isinstance(names, basestring):
+            return FakeRobot.Chains.get(names, [names])
+        return list(names)
+
+
+    def angle(self, joint, now = None):
+        """ @return the current angle of \a joint """
+        now                 = time.time() if now is None else now
+        start_time, start   = self.start[joint]
+        target, speed       = self.target[joint]
+        step                = speed * (now - start_time)
+        return target if abs(target - start) <= step else start + np.sign(target - start) * step
+
+
+    def move(self, joints, angles, speed):
+        """ This method sets new targets for the \a joints and returns the time to reach them. """
+        speed = max(speed, 1e-3)
+
+        with self.lock:
+            now      = time.time()
+            duration = 0.0
+            task     = getattr(self._local, 'task', None)
+            if task is not None:
+                task.joints.update(joints)
+
+            for joint, angle in zip(joints, angles):
+                self.start[joint]  = (now, self.angle(joint, now))
+                self.target[joint] = (angle, speed)
+                duration = max(duration, abs(angle - self.start[joint][1]) / speed)
+            self.posture = 'Unknown'
+            return duration
+
+
+    def halt(self, joints = None):
+        """ This method stops the \a joints (default: all) at their current angles. """
+        with self.lock:
+            now = time.time()
+            for joint in FakeRobot.Joints if joints is None else joints:
+                angle              = self.angle(joint, now)
+                self.start[joint]  = (now, angle)
+                self.target[joint] = (angle, FakeRobot.MAX_SPEED)
+
+
+    def run(self, duration):
+        """ This method simulates a motion task of \a duration seconds. Within a posted call the
+            posted task is used.
+
+        @return True if the task ran to its end, False if it got stopped
+        """
+        task = getattr(self._local, 'task', None)
+        if task is not None:
+            return not task.stopped.wait(duration)
+
+        task = self._startTask()
+        try:
+            return not task.stopped.wait(duration)
+        finally:
+            self._endTask(task)
+
+
+    def post(self, method, args):
+        """ This method calls \a method in a thread, like the post attribute of a proxy.
+
+        @return integer task id
+        """
+        task = self._startTask()
+
+        def run():
+            self._local.task = task
+            try:
+                method(*args)
+            finally:
+                self._local.task = None
+                self._endTask(task)
+
+        thread        = threading.Thread(target = run, name = 'FakeTask-%d' % task.id)
+        thread.daemon = True
+        thread.start()
+        return task.id
+
+
+    def stop(self, taskId):
+        """ This method stops the task \a taskId and its joints. """
+        with self.lock:
+            task = self.tasks.get(taskId)
+            if task is not None:
+                task.stopped.set()
+                self.halt(task.joints)
+
+
+    def wait(self, taskId, timeout):
+        """ This method waits for the task \a taskId; a \a timeout of 0 waits without limit. """
+        with self.lock:
+            task = self.tasks.get(taskId)
+        if task is not None:
+            task.finished.wait(timeout / 1000.0 if timeout > 0 else None)
+
+
+    def killAll(self):
+        """ This method kills all running motion tasks and stops the joints. """
+        with self.lock:
+            for task in self.tasks.values():
+                task.stopped.set()
+            self.halt()
+
+
+    def _startTask(self):
+        with self.lock:
+            task                = FakeTask(next(self.taskIds))
+            self.tasks[task.id] = task
+            return task
+
+
+    def _endTask(self, task):
+        with self.lock:
+            self.tasks.pop(task.id, None)
+        task.finished.set()
+
+
+class FakePost(object):
+    """ Stand-in for the post attribute of a proxy: methods run in a thread and return a task id.
+    """
+
+    def __init__(self, service):
+        self._service = service
+
+
+    def __getattr__(self, name):
+        method = getattr(self._service, name)
+        return lambda *args: self._service.robot.post(method, args)
+
+
+class FakeService(object):
+    """ Base class of the fake services. """
+
+    def __init__(self, robot):
+        self.robot = robot
+        self.post  = FakePost(self)
+
+
+    def ping(self):
+        return True
+
+
+    def stop(self, taskId):
+        self.robot.stop(taskId)
+
+
+    def isRunning(self, taskId):
+        return taskId in self.robot.tasks
+
+
+    def wait(self, taskId, timeoutPeriod):
+        self.robot.wait(taskId, timeoutPeriod)
+
+
+class FakeALMotion(FakeService):
+    """ Stand-in for ALMotion. """
+
+    def getBodyNames(self, name):
+        return self.robot.names(name)
+
+
+    def setAngles(self, names, angles, fractionMaxSpeed):
+        FakeRobot.delay()
+        names  = self.robot.names(names)
+        angles = angles if isinstance(angles, (list, tuple)) else [angles] * len(names)
+        self.robot.move(names, angles, FakeRobot.MAX_SPEED * fractionMaxSpeed)
+
+
+    def angleInterpolation(self, names, angles, times, isAbsolute):
+        FakeRobot.delay()
+        names    = self.robot.names(names)
+        angles   = [ a[-1] if isinstance(a, (list, tuple)) else a for a in angles ]
+        times    = [ t[-1] if isinstance(t, (list, tuple)) else t for t in times ] \
+                   if isinstance(times, (list, tuple)) else [times] * len(names)
+        duration = max(times)
+        self.robot.move(names, angles, FakeRobot.MAX_SPEED)
+        self.robot.run(duration)
+
+
+    def getAngles(self, names, useSensors):
+        FakeRobot.delay()
+        with self.robot.lock:
+            return [ self.robot.angle(joint) for joint in self.robot.names(names) ]
+
+
+    def stiffnessInterpolation(self, names, stiffnesses, times):
+        FakeRobot.delay()
+        self.setStiffnesses(names, stiffnesses)
+        self.robot.run(times[-1] if isinstance(times, (list, tuple)) else times)
+
+
+    def setStiffnesses(self, names, stiffnesses):
+        FakeRobot.delay()
+        if isinstance(names, basestring):
+            names, stiffnesses = [names], [stiffnesses]
+
+        with self.robot.lock:
+            for name, stiffness in zip(names, stiffnesses):
+                for joint in self.robot.names(name):
+                    self.robot.stiffness[joint] = stiffness
+
+
+    def getStiffnesses(self, names):
+        FakeRobot.delay()
+        with self.robot.lock:
+            return [ self.robot.stiffness[joint] for joint in self.robot.names(names) ]
+
+
+    def setPosition(self, effector, frame, position, fractionMaxSpeed, axisMask):
+        FakeRobot.delay()
+        with self.robot.lock:
+            self.robot.positions[effector] = list(position)
+            self.robot.posture             = 'Unknown'
+
+
+    def positionInterpolations(self, effectors, frame, paths, axisMasks, times):
+        FakeRobot.delay()
+        with self.robot.lock:
+            for effector, path in zip(effectors, paths):
+                self.robot.positions[effector] = list(path[-1] if isinstance(path[0], list) 
+                                                      else path)
+            self.robot.posture = 'Unknown'
+
+        self.robot.run(max( t[-1] if isinstance(t, (list, tuple)) else t for t in times ))
+
+
+    def getPosition(self, effector, frame, useSensors):
+        FakeRobot.delay()
+        with self.robot.lock:
+            return list(self.robot.positions.get(effector, [0.0] * 6))
+
+
+    def killAll(self):
+        FakeRobot.delay()
+        self.robot.killAll()
+
+
+    def openHand(self, hand):
+        self.setAngles(hand, [1.0], 1.0)
+
+
+    def closeHand(self, hand):
+        self.setAngles(hand, [0.0], 1.0)
+
+
+class FakeALMemory(FakeService):
+    """ Stand-in for ALMemory. Only the joint position and stiffness keys of the DCM are
+        simulated, e.g. Device/SubDeviceList/HeadYaw/Position/Sensor/Value.
+    """
+
+    def getListData(self, keys):
+        FakeRobot.delay()
+        with self.robot.lock:
+            return [ self.getValue(key) for key in keys ]
+
+
+    def getValue(self, key):
+        parts = key.split('/')
+        if len(parts) != 6 or parts[:2] != ['Device', 'SubDeviceList'] or \
+                parts[2] not in self.robot.stiffness:
+            raise RuntimeError('Key is not simulated: %s' % key)
+
+        if parts[3] == 'Position':
+            return self.robot.angle(parts[2])
+        return self.robot.stiffness[parts[2]]
+
+
+class FakeALRobotPosture(FakeService):
+    """ Stand-in for ALRobotPosture. """
+
+    def goToPosture(self, name, speed):
+        FakeRobot.delay()
+        if name not in FakeRobot.Postures:
+            return False
+
+        posture  = FakeRobot.Postures[name]
+        duration = self.robot.move(posture.keys(), posture.values(), FakeRobot.MAX_SPEED * speed)
+        if not self.robot.run(duration):
+            return False
+        self.robot.posture = name
+        return True
+
+
+    def getPosture(self):
+        FakeRobot.delay()
+        return self.robot.posture
+
+
+    def getPostureList(self):
+        return sorted(FakeRobot.Postures.keys())
+
+
+class FakeALVideoDevice(FakeService):
+    """ Stand-in for ALVideoDevice. The images are a synthetic gradient pattern that moves with
+        every frame.
+    """
+
+    Sizes       = { 0: (160, 120), 1: (320, 240), 2: (640, 480), 3: (1280, 960) }
+    Layers      = { 0: 1, 9: 2, 11: 3, 13: 3 }
+
+
+    def __init__(self, robot):
+        FakeService.__init__(self, robot)
+        self.clients  = {}
+        self.patterns = {}
+
+
+    def subscribeCamera(self, name, camera, resolution, colorspace, fps):
+        FakeRobot.delay()
+        client = '%s_%d' % (name, len(self.clients))
+        self.clients[client] = (camera, resolution, colorspace, fps)
+        return client
+
+
+    def unsubscribe(self, client):
+        FakeRobot.delay()
+        return self.clients.pop(client, None) is not None
+
+
+    def getImageRemote(self, client):
+        FakeRobot.delay()
+        camera, resolution, colorspace, fps = self.clients[client]
+        width, height = FakeALVideoDevice.Sizes[resolution]
+        layers        = FakeALVideoDevice.Layers[colorspace]
+
+        key = (resolution, layers)
+        if key not in self.patterns:
+            x = np.arange(2 * width, dtype = np.uint32)
+            y = np.arange(height,    dtype = np.uint32)[:, np.newaxis]
+            pattern = ((x + y) % 256).astype(np.uint8)
+            self.patterns[key] = np.repeat(pattern[:, :, np.newaxis], layers, axis = 2)
+
+        self.robot.frames += 1
+        shift   = self.robot.frames % width
+        data    = self.patterns[key][:, shift:shift + width].tostring()
+        now     = time.time()
+
+        return [ width, height, layers, colorspace, int(now), int((now % 1) * 1e6), data, camera ]
+
+
+Services = { 'ALMemory':       FakeALMemory,
+             'ALMotion':       FakeALMotion,
+             'ALRobotPosture': FakeALRobotPosture,
+             'ALVideoDevice':  FakeALVideoDevice }
+
+
+def ALProxy(service, ip, port):
+    """ Stand-in for naoqi.ALProxy.
+
+    @param service - string specifying the service, one of Services
+    @param ip      - string specifying the IP address of the simulated robot
+    @param port    - integer specifying the port of the simulated robot
+    @return fake service
+    """
+    if service not in Services:
+        raise RuntimeError('Service %s is not simulated' % service)
+    return Services[service](FakeRobot.get(ip, int(port)))
@@ -0,0 +1,118 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+import base64
+import io
+import threading
+import traceback
+
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from PIL import Image
+
+
+# encoding name -> PIL format
+FORMATS = { 'jpeg': 'JPEG', 'png': 'PNG' }
+
+
+def encodeFrame(array, encoding = 'jpeg', quality = 80, level = 6):
+    """ This method encodes an image.
+
+    @param array    - uint8 array of shape (height, width, 3) or (height, width)
+    @param encoding - string specifying the encoding, 'jpeg' or 'png' (default: 'jpeg')
+    @param quality  - integer specifying the JPEG quality [1, 95]    (default: 80)
+    @param level    - integer specifying the PNG compression [0, 9]  (default: 6)
+    @return string containing the encoded image
+    """
+    buf = io.BytesIO()
+
+    if encoding == 'jpeg':
+        Image.fromarray(array).save(buf, FORMATS[encoding], quality = quality)
+    else:
+        Image.fromarray(array).save(buf, FORMATS[encoding], compress_level = level)
+
+    return buf.getvalue()
+
+
+def decodeFrame(bottle):
+    """ This method decodes a bottle written by a FrameEncoder.
+
+    @param bottle - yarp.Bottle (<encoding> <width> <height> <seq> <base64 data> ...)
+    @return sequence number, uint8 image array
+    """
+    seq   = bottle.get(3).asInt()
+    data  = base64.b64decode(bottle.get(4).asString())
+    return seq, np.asarray(Image.open(io.BytesIO(data)))
+
+
+class FrameEncoder(object):
+    """ The FrameEncoder class encodes frames in a pool of worker threads and passes the results
+        to a callback. PIL releases the GIL while encoding, so the workers run in parallel.
+    """
+
+    def __init__(self, encoding = 'jpeg', quality = 80, level = 6, workers = 2):
+        """
+        @param encoding - string specifying the encoding, 'jpeg' or 'png' (default: 'jpeg')
+        @param quality  - integer specifying the JPEG quality [1, 95]    (default: 80)
+        @param level    - integer specifying the PNG compression [0, 9]  (default: 6)
+        @param workers  - integer specifying the number of worker threads (default: 2)
+        """
+        if encoding not in FORMATS:
+            raise ValueError('Unknown encoding: %s' % encoding)
+
+        self.encoding = encoding
+        self.quality  = int(quality)
+        self.level    = int(level)
+        self._pool    = ThreadPool(workers)
+        self._pending = 0
+        self._workers = workers
+        self._lock    = threading.Lock()
+
+
+    def submit(self, seq, array, callback):
+        """ This method encodes \a array in the worker pool. If all workers are busy the frame is
+            dropped, so the encoder never builds up a backlog.
+
+        @param seq      - integer specifying the sequence number of the frame
+        @param array    - uint8 image array; it must not be modified until the callback was called
+        @param callback - callable taking the sequence number, the array and the encoded string
+        @return True if the frame was submitted
+        """
+        with self._lock:
+            if self._pending >= self._workers:
+                return False
+            self._pending += 1
+
+        self._pool.apply_async(self._encode, (seq, array, callback))
+        return True
+
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+
+    def _encode(self, seq, array, callback):
+        try:
+            callback(seq, array, encodeFrame(array, self.encoding, self.quality, self.level))
+        except Exception:
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                self._pending -= 1
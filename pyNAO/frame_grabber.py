@@ -0,0 +1,160 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+import threading
+import time
+import traceback
+
+from pyNAO.metrics import METRICS
+
+
+class LatestFrameSlot(object):
+    """ The LatestFrameSlot class is a single element buffer between a producer and a consumer
+        thread. Putting a frame replaces a frame that was not taken yet, so the consumer always gets
+        the most recent frame and a slow consumer never blocks the producer.
+    """
+
+    def __init__(self):
+        self._cond    = threading.Condition()
+        self._frame   = None
+        self._seq     = 0
+        self._closed  = False
+        self.dropped  = 0
+
+
+    def put(self, frame):
+        """ This method stores \a frame and drops the previous frame if it was not taken yet.
+
+        @param frame - arbitrary frame object
+        @return sequence number of the frame
+        """
+        with self._cond:
+            if self._frame is not None:
+                self.dropped += 1
+            self._seq   += 1
+            self._frame  = frame
+            self._cond.notify()
+            return self._seq
+
+
+    def take(self, timeout = None):
+        """ This method waits for a frame and removes it from the slot.
+
+        @param timeout - float specifying the maximum time to wait in seconds (default: None)
+        @return (sequence number, frame) or None if the timeout elapsed or the slot was closed
+        """
+        with self._cond:
+            if self._frame is None and not self._closed:
+                self._cond.wait(timeout)
+
+            if self._frame is None:
+                return None
+
+            frame, self._frame = self._frame, None
+            return self._seq, frame
+
+
+    def close(self):
+        """ This method wakes up all waiting consumers. """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class FrameGrabber(threading.Thread):
+    """ The FrameGrabber thread fetches frames at a target rate and puts them into a
+        LatestFrameSlot.
+    """
+
+    def __init__(self, fetch, slot, fps = 30.0, name = 'FrameGrabber', metric = 'video'):
+        """
+        @param fetch  - callable returning a frame or None
+        @param slot   - LatestFrameSlot receiving the frames
+        @param fps    - float specifying the target frame rate; 0 fetches as fast as possible
+        @param name   - string specifying the thread name (default: 'FrameGrabber')
+        @param metric - string specifying the prefix of the metric names (default: 'video')
+        """
+        threading.Thread.__init__(self, name = name)
+        self.daemon   = True
+        self.fetch    = fetch
+        self.slot     = slot
+        self.period   = 1.0 / fps if fps > 0 else 0.0
+        self.metric   = metric
+        self._stopped = threading.Event()
+
+
+    def stop(self):
+        self._stopped.set()
+
+
+    def run(self):
+        next_time = time.time()
+
+        while not self._stopped.is_set():
+            try:
+                with METRICS.timer(self.metric + '.fetch'):
+                    frame = self.fetch()
+            except Exception:
+                traceback.print_exc()
+                frame = None
+
+            if frame is not None:
+                dropped = self.slot.dropped
+                self.slot.put(frame)
+                METRICS.count(self.metric + '.frames')
+                METRICS.count(self.metric + '.dropped', self.slot.dropped - dropped)
+
+            # keep the target rate without accumulating a backlog after a slow fetch
+            next_time = max(next_time + self.period, time.time())
+            self._stopped.wait(next_time - time.time())
+
+
+class FramePublisher(threading.Thread):
+    """ The FramePublisher thread takes the latest frame from a LatestFrameSlot and publishes it.
+    """
+
+    def __init__(self, publish, slot, name = 'FramePublisher', metric = 'video'):
+        """
+        @param publish - callable taking the sequence number and the frame
+        @param slot    - LatestFrameSlot providing the frames
+        @param name    - string specifying the thread name (default: 'FramePublisher')
+        @param metric  - string specifying the prefix of the metric names (default: 'video')
+        """
+        threading.Thread.__init__(self, name = name)
+        self.daemon   = True
+        self.publish  = publish
+        self.slot     = slot
+        self.metric   = metric
+        self._stopped = threading.Event()
+
+
+    def stop(self):
+        self._stopped.set()
+        self.slot.close()
+
+
+    def run(self):
+        while not self._stopped.is_set():
+            item = self.slot.take(0.5)
+            if item is None:
+                continue
+
+            try:
+                with METRICS.timer(self.metric + '.publish'):
+                    self.publish(*item)
+            except Exception:
+                traceback.print_exc()
@@ -0,0 +1,256 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+import numpy as np
+
+import yarp
+
+from pyNAO.BaseModule import EMSG_YARP_NOT_FOUND
+from pyNAO.metrics    import METRICS
+
+
+class Stage(object):
+    """ The Stage class is the base class of the image processing stages of a FramePipeline. A stage
+        takes a uint8 array of shape (height, width, 3) or (height, width) and returns a new one.
+    """
+
+    def __init__(self, name):
+        self.name    = name
+        self.port    = None
+        self._buffer = None
+
+
+    def process(self, array):
+        raise NotImplementedError
+
+
+    def reset(self):
+        """ This hook method gets called when the stage is skipped, e.g. to drop a stored frame. """
+        pass
+
+
+    def open(self, port_base):
+        self.port = yarp.Port()
+        if not self.port.open('%s/%s:o' % (port_base, self.name)):
+            raise RuntimeError(EMSG_YARP_NOT_FOUND)
+
+
+    def isConnected(self):
+        return self.port is not None and self.port.getOutputCount() > 0
+
+
+    def publish(self, array, stamp):
+        """ This method writes \a array as yarp image (RGB or mono) to the port of the stage.
+
+        @param array - uint8 array of shape (height, width, 3) or (height, width)
+        @param stamp - yarp.Stamp of the frame
+        """
+        if self._buffer is None or self._buffer[1].shape != array.shape:
+            self._buffer = createStageImage(array.shape)
+
+        image, buf = self._buffer
+        np.copyto(buf, array)
+        self.port.setEnvelope(stamp)
+        self.port.write(image)
+
+
+class Downscale(Stage):
+    """ Reduces the resolution by an integer factor, averaging blocks of factor x factor pixels. """
+
+    # the block sums are uint16, which holds up to 257 pixels
+    MAX_FACTOR = 16
+
+
+    def __init__(self, name, factor = 2):
+        Stage.__init__(self, name)
+        self.factor = int(factor)
+        if not 1 <= self.factor <= Downscale.MAX_FACTOR:
+            raise ValueError('Downscale factor needs to be between 1 and %d: %s'
+                             % (Downscale.MAX_FACTOR, factor))
+
+
+    def process(self, array):
+        f      = self.factor
+        height = array.shape[0] // f
+        width  = array.shape[1] // f
+        blocks = array[:height * f, :width * f].reshape((height, f, width, f) + array.shape[2:])
+        return (blocks.sum(axis = (1, 3), dtype = np.uint16) // (f * f)).astype(np.uint8)
+
+
+class Crop(Stage):
+    """ Cuts out the region of interest x:y:width:height. """
+
+    def __init__(self, name, x = 0, y = 0, width = 160, height = 120):
+        Stage.__init__(self, name)
+        self.x, self.y, self.width, self.height = int(x), int(y), int(width), int(height)
+        if self.x < 0 or self.y < 0 or self.width <= 0 or self.height <= 0:
+            raise ValueError('Crop region needs a non-negative origin and a positive size: '
+                             '%s:%s:%s:%s' % (x, y, width, height))
+
+
+    def process(self, array):
+        return array[self.y:self.y + self.height, self.x:self.x + self.width]
+
+
+class Gray(Stage):
+    """ Converts RGB to grayscale with the BT.601 luma weights in integer arithmetic. """
+
+    WEIGHTS = np.array([77, 150, 29], dtype = np.uint16)
+
+
+    def process(self, array):
+        if array.ndim == 2:
+            return array
+        return (np.dot(array, Gray.WEIGHTS) >> 8).astype(np.uint8)
+
+
+class Diff(Stage):
+    """ Detects motion: pixels that changed by more than a threshold since the previous frame are
+        255, all others 0. The first frame after a reset has no motion.
+    """
+
+    def __init__(self, name, threshold = 25):
+        Stage.__init__(self, name)
+        self.threshold = int(threshold)
+        self._previous = None
+
+
+    def reset(self):
+        self._previous = None
+
+
+    def process(self, array):
+        current = array.astype(np.int16)
+        if self._previous is None or self._previous.shape != current.shape:
+            self._previous = current
+
+        diff           = np.abs(current - self._previous)
+        self._previous = current
+
+        if diff.ndim == 3:
+            diff = diff.max(axis = 2)
+        return np.where(diff > self.threshold, 255, 0).astype(np.uint8)
+
+
+# stage name -> stage class
+STAGES = { 'downscale': Downscale, 'crop': Crop, 'gray': Gray, 'diff': Diff }
+
+
+def createStageImage(shape):
+    """ This method creates a yarp image that wraps a uint8 array of \a shape. Unlike
+        NaoVideo.createImageBuffer, single channel frames become 8 bit mono images.
+
+    @param shape - (height, width, 3) for RGB or (height, width) for mono images
+    @return image, buffer array
+    """
+    image = yarp.ImageRgb() if len(shape) == 3 else yarp.ImageMono()
+    image.resize(shape[1], shape[0])
+
+    array = np.zeros(shape, dtype = np.uint8)
+    image.setExternal(array, shape[1], shape[0])
+    return image, array
+
+
+class FramePipeline(object):
+    """ The FramePipeline class applies a chain of stages to the frames of a camera stream. Each
+        stage publishes its result on <port_base>/<stage>:o.
+
+    A frame only runs through the stages up to the last one that has a reader, so the processing
+    cost follows the connected consumers.
+    """
+
+    def __init__(self, stages, metric = 'video'):
+        """
+        @param stages - list of Stage objects
+        @param metric - string specifying the prefix of the metric names (default: 'video')
+        """
+        self.stages = stages
+        self.metric = metric
+
+
+    @staticmethod
+    def parse(spec, metric = 'video'):
+        """ This method creates a pipeline from a string of the form <stage>[=<arg>[:<arg>]],...
+            e.g. 'downscale=2,crop=0:0:80:60,gray,diff=25'. Repeated stages get numbered names.
+
+        @param spec   - string specifying the stages
+        @param metric - string specifying the prefix of the metric names (default: 'video')
+        @return FramePipeline
+        """
+        stages = []
+        kinds  = [ item.split('=', 1)[0] for item in spec.split(',') ]
+
+        for index, item in enumerate(spec.split(',')):
+            kind, _, args = item.partition('=')
+            if kind not in STAGES:
+                raise ValueError('Unknown stage: %s (known: %s)'
+                                 % (kind, ', '.join(sorted(STAGES))))
+
+            name = kind if kinds.count(kind) == 1 else '%s%d' % (kind, index)
+            args = args.split(':') if args else []
+            stages.append(STAGES[kind](name, *args))
+
+        return FramePipeline(stages, metric)
+
+
+    def check(self, shape):
+        """ This method runs a blank frame of \a shape through all stages, so a stage that cannot
+            process the frames of a stream fails before the stream starts.
+
+        @param shape - (height, width, 3) of the frames
+        """
+        array = np.zeros(shape, dtype = np.uint8)
+        for stage in self.stages:
+            array = stage.process(array)
+            if array.size == 0:
+                raise ValueError('Stage %s produces empty frames for frames of %dx%d pixels'
+                                 % (stage.name, shape[1], shape[0]))
+            stage.reset()
+
+
+    def open(self, port_base):
+        for stage in self.stages:
+            stage.open(port_base)
+
+
+    def process(self, array, stamp):
+        """ This method runs \a array through the stages that have readers downstream.
+
+        @param array - uint8 array of the frame
+        @param stamp - yarp.Stamp of the frame
+        """
+        connected = [ stage.isConnected() for stage in self.stages ]
+        last      = max([ i for i, c in enumerate(connected) if c ] or [-1])
+
+        for stage in self.stages[last + 1:]:
+            stage.reset()
+
+        for stage, isConnected in zip(self.stages[:last + 1], connected):
+            with METRICS.timer('%s.%s' % (self.metric, stage.name)):
+                array = stage.process(array)
+            if isConnected:
+                stage.publish(array, stamp)
+
+
+    def interrupt(self):
+        for stage in self.stages:
+            stage.port.interrupt()
+
+
+    def close(self):
+        for stage in self.stages:
+            stage.port.close()
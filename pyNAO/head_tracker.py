@@ -0,0 +1,94 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+import threading
+
+import numpy as np
+
+
+class HeadTracker(object):
+    """ The HeadTracker class lets the head follow a stream of fixation points.
+
+    The latest fixation point is converted to head angles, low-pass filtered and speed limited at a
+    fixed control rate. A command is only sent to ALMotion if it differs from the last one by more
+    than the dead band, so a high rate target stream does not flood ALMotion.
+    """
+
+    Joints    = ['HeadPitch', 'HeadYaw']
+
+    RATE      = 20.0            # control rate in Hz
+    SMOOTHING = 0.5             # weight of the new target in the exponential filter [0, 1]
+    MAX_SPEED = 2.0             # in rad/s
+    DEAD_BAND = 0.01            # in rad
+    SPEED     = 0.2             # fraction of maximum joint speed used by setAngles
+
+
+    def __init__(self, nao, rate = RATE, smoothing = SMOOTHING, maxSpeed = MAX_SPEED,
+                 deadBand = DEAD_BAND):
+        """
+        @param nao       - Nao object
+        @param rate      - float specifying the control rate in Hz
+        @param smoothing - float specifying the weight of the new target in the filter [0, 1]
+        @param maxSpeed  - float specifying the maximum angular speed in rad/s
+        @param deadBand  - float specifying the minimum angle change that gets sent in rad
+        """
+        self.nao       = nao
+        self.period    = 1.0 / rate
+        self.smoothing = smoothing
+        self.maxStep   = maxSpeed * self.period
+        self.deadBand  = deadBand
+        self._target   = None
+        self._lock     = threading.Lock()
+
+
+    def update(self, vector):
+        """ This method sets a new fixation point. It is cheap and can be called at any rate.
+
+        @param vector - fixation point [x, y, z] in the torso frame
+        """
+        pitch, yaw, _ = self.nao.getPitchesAndYaws(vector)
+        with self._lock:
+            self._target = np.array([pitch[0], yaw[0]])
+
+
+    def run(self, handle):
+        """ This method is the control loop. It is executed as motion on the head motion queue and
+            runs until the \a handle gets cancelled.
+
+        @param handle - MotionHandle
+        """
+        self.nao.waitInitialized()
+
+        motionProxy = self.nao.motionProxy
+        command     = np.array(motionProxy.getAngles(HeadTracker.Joints, True))
+        sent        = command.copy()
+
+        while handle.sleep(self.period):
+            with self._lock:
+                target = self._target
+
+            if target is None:
+                continue
+
+            # low-pass filter and speed limit
+            step     = self.smoothing * (target - command)
+            command += np.clip(step, -self.maxStep, self.maxStep)
+
+            if np.max(np.abs(command - sent)) > self.deadBand:
+                self.nao.markMoved(self.nao.Head)
+                motionProxy.setAngles(HeadTracker.Joints, command.tolist(), HeadTracker.SPEED)
+                sent = command.copy()
@@ -0,0 +1,171 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+import threading
+
+import numpy as np
+
+
+def direction(vectors, shoulderOffset):
+    """ This method returns the pointing direction from the shoulder to \a vectors.
+
+    @param vectors        - array of shape (N, 3) or (3,) with points in the torso frame
+    @param shoulderOffset - shoulder position in the torso frame
+    @return azimuth array, elevation array and distance array in radians/meters
+    """
+    vectors   = np.asarray(vectors, dtype = np.float64).reshape(-1, 3) - shoulderOffset
+    azimuth   = np.arctan2(vectors[:, 1], vectors[:, 0])
+    elevation = np.arctan2(vectors[:, 2], np.hypot(vectors[:, 0], vectors[:, 1]))
+    return azimuth, elevation, np.sqrt((vectors ** 2).sum(axis = 1))
+
+
+class IKTable(object):
+    """ The IKTable class maps pointing directions of an arm to joint configurations. The reachable
+        directions (azimuth, elevation) are discretized into a grid and each cell holds the joint
+        angles of one known pointing pose and the direction it points to.
+
+    A lookup interpolates the known poses next to the requested direction by inverse distance
+    weighting, so a pointing motion can be executed with angleInterpolation in joint space instead
+    of letting ALMotion solve the inverse kinematics. The table can be learned on the fly from the
+    poses the robot reached, calibrated in advance and saved to a file.
+    """
+
+    def __init__(self, arm, joints, workspace, bins = 16, neighbours = 4, maxDistance = 0.15):
+        """
+        @param arm         - string specifying the arm, 'LArm' or 'RArm'
+        @param joints      - list of joint names of the stored configurations
+        @param workspace   - dictionary with (min, max) of 'azimuth' and 'elevation' in radians
+        @param bins        - integer specifying the number of cells per dimension (default: 16)
+        @param neighbours  - integer specifying the number of poses to interpolate (default: 4)
+        @param maxDistance - float specifying the maximum distance in radians between the requested
+                             direction and the nearest known pose (default: 0.15)
+        """
+        self.arm         = arm
+        self.joints      = list(joints)
+        self.workspace   = workspace
+        self.bins        = int(bins)
+        self.neighbours  = int(neighbours)
+        self.maxDistance = float(maxDistance)
+        self.angles      = np.zeros((self.bins, self.bins, len(self.joints)))
+        self.directions  = np.zeros((self.bins, self.bins, 2))
+        self.known       = np.zeros((self.bins, self.bins), dtype = bool)
+        self._lock       = threading.Lock()
+
+
+    def __len__(self):
+        return int(self.known.sum())
+
+
+    def cell(self, azimuth, elevation):
+        """ This method returns the grid cell of a direction; directions outside of the workspace
+            are mapped to the border cells.
+
+        @param azimuth   - float specifying the azimuth in radians
+        @param elevation - float specifying the elevation in radians
+        @return (row, column)
+        """
+        index = []
+        for value, key in ((azimuth, 'azimuth'), (elevation, 'elevation')):
+            low, high = self.workspace[key]
+            index.append(int(np.clip((value - low) / (high - low) * self.bins, 0, self.bins - 1)))
+        return tuple(index)
+
+
+    def centers(self):
+        """ @return array of shape (bins * bins, 2) with the (azimuth, elevation) cell centers """
+        axes = [ np.linspace(low, high, self.bins, endpoint = False) + (high - low) / self.bins / 2
+                 for low, high in (self.workspace['azimuth'], self.workspace['elevation']) ]
+        return np.dstack(np.meshgrid(*axes, indexing = 'ij')).reshape(-1, 2)
+
+
+    def learn(self, azimuth, elevation, angles):
+        """ This method stores the joint \a angles of a pose pointing to (\a azimuth, \a elevation).
+            A pose replaces the pose of its cell if it is closer to the cell center.
+
+        @param azimuth   - float specifying the azimuth in radians
+        @param elevation - float specifying the elevation in radians
+        @param angles    - list of joint angles in the order of IKTable.joints
+        @return True if the pose was stored
+        """
+        index  = self.cell(azimuth, elevation)
+        center = self.centers().reshape(self.bins, self.bins, 2)[index]
+
+        with self._lock:
+            if self.known[index]:
+                old = np.hypot(*(self.directions[index] - center))
+                if np.hypot(azimuth - center[0], elevation - center[1]) > old:
+                    return False
+
+            self.angles[index]     = angles
+            self.directions[index] = (azimuth, elevation)
+            self.known[index]      = True
+            return True
+
+
+    def lookup(self, azimuth, elevation):
+        """ This method interpolates the joint angles for pointing to (\a azimuth, \a elevation).
+
+        @param azimuth   - float specifying the azimuth in radians
+        @param elevation - float specifying the elevation in radians
+        @return list of joint angles or None if no known pose is close enough
+        """
+        with self._lock:
+            known      = self.known.ravel()
+            if not known.any():
+                return None
+            directions = self.directions.reshape(-1, 2)[known]
+            angles     = self.angles.reshape(-1, len(self.joints))[known]
+
+        distances = np.hypot(directions[:, 0] - azimuth, directions[:, 1] - elevation)
+        nearest   = np.argsort(distances)[:self.neighbours]
+
+        if distances[nearest[0]] > self.maxDistance:
+            return None
+        if distances[nearest[0]] < 1e-6:
+            return angles[nearest[0]].tolist()
+
+        nearest   = nearest[distances[nearest] <= self.maxDistance]
+        weights   = 1.0 / distances[nearest]
+        return (np.dot(weights, angles[nearest]) / weights.sum()).tolist()
+
+
+    def save(self, filename):
+        """ This method writes the table to a .npz file.
+
+        @param filename - string specifying the file name
+        """
+        with self._lock:
+            np.savez(filename, arm = self.arm, joints = self.joints, bins = self.bins,
+                     angles = self.angles, directions = self.directions, known = self.known)
+
+
+    def load(self, filename):
+        """ This method reads the poses of a table written by IKTable.save. The table needs to have
+            the same arm, joints and grid size.
+
+        @param filename - string specifying the file name
+        """
+        data = np.load(filename)
+
+        if str(data['arm']) != self.arm or list(data['joints']) != self.joints \
+                or int(data['bins']) != self.bins:
+            raise ValueError('IK table %s does not match the %s table' % (filename, self.arm))
+
+        with self._lock:
+            self.angles     = data['angles']
+            self.directions = data['directions']
+            self.known      = data['known']
@@ -0,0 +1,60 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+""" Runs several modules in one process, e.g.:
+
+    python -m pyNAO.launcher NaoController NaoVideo [--ip <IP Address>] [...]
+"""
+import importlib
+import sys
+
+from pyNAO.BaseModule import main
+
+
+# module name -> python module containing the class
+MODULES = { 'NaoController': 'pyNAO.nao_controller',
+            'NaoVideo':      'pyNAO.nao_video',
+            'NaoFleet':      'pyNAO.nao_fleet',
+            'NaoReplay':     'pyNAO.nao_replay' }
+
+
+def loadModuleClasses(names):
+    """ This method imports the module classes given by \a names.
+
+    @param names - list of module names, see MODULES
+    @return list of BaseModule based classes
+    """
+    classes = []
+    for name in names:
+        if name not in MODULES:
+            raise ValueError('Unknown module: %s (known: %s)' % (name, ', '.join(sorted(MODULES))))
+        classes.append(getattr(importlib.import_module(MODULES[name]), name))
+    return classes
+
+
+if __name__ == '__main__':
+
+    # the module names come first, the remaining arguments are parsed by main
+    names = []
+    while len(sys.argv) > 1 and not sys.argv[1].startswith('-'):
+        names.append(sys.argv.pop(1))
+
+    if not names:
+        print 'usage: python -m pyNAO.launcher <ModuleName> [<ModuleName> ...] [options]'
+        sys.exit(1)
+
+    main(*loadModuleClasses(names))
@@ -0,0 +1,169 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+import bisect
+import os
+import threading
+import time
+
+
+class Histogram(object):
+    """ The Histogram class records durations in logarithmic buckets from 1us to 100s. """
+
+    # upper bounds of the buckets in seconds, 10 per decade
+    BOUNDS = [ 10 ** (exp / 10.0) for exp in range(-60, 21) ]
+
+
+    def __init__(self):
+        self.counts = [0] * (len(Histogram.BOUNDS) + 1)
+        self.count  = 0
+        self.total  = 0.0
+        self.max    = 0.0
+
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(Histogram.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max    = max(self.max, value)
+
+
+    def percentile(self, fraction):
+        """ @return upper bucket bound below which \a fraction of the values are """
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return Histogram.BOUNDS[index] if index < len(Histogram.BOUNDS) else self.max
+        return 0.0
+
+
+class _Timer(object):
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name    = name
+
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+
+    def __exit__(self, *args):
+        self.metrics.observe(self.name, time.time() - self.start)
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics(object):
+    """ The Metrics class collects counters and duration histograms. While it is disabled all
+        methods return immediately.
+    """
+
+    def __init__(self, enabled = False):
+        self.enabled    = enabled
+        self.counters   = {}
+        self.histograms = {}
+        self._lock      = threading.Lock()
+
+
+    def count(self, name, value = 1):
+        """ This method adds \a value to the counter \a name. """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+    def observe(self, name, seconds):
+        """ This method records a duration of \a seconds in the histogram \a name. """
+        if not self.enabled:
+            return
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds)
+
+
+    def timer(self, name):
+        """ This method returns a context manager recording the duration of its block.
+
+        @param name - string specifying the histogram name
+        @return context manager
+        """
+        return _Timer(self, name) if self.enabled else _NULL_TIMER
+
+
+    def snapshot(self):
+        """ @return dictionary with the counters and for each histogram count, mean, p50, p99 and
+                    max in seconds
+        """
+        with self._lock:
+            histograms = dict( (name, { 'count': h.count,
+                                        'mean':  h.total / h.count,
+                                        'p50':   h.percentile(0.5),
+                                        'p99':   h.percentile(0.99),
+                                        'max':   h.max })
+                               for name, h in self.histograms.items() )
+            return { 'counters': dict(self.counters), 'histograms': histograms }
+
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+class InstrumentedProxy(object):
+    """ The InstrumentedProxy class wraps a proxy and records the duration of every method call as
+        proxy.<service>.<method>.
+    """
+
+    def __init__(self, proxy, service, metrics):
+        self._proxy   = proxy
+        self._service = service
+        self._metrics = metrics
+
+
+    def __getattr__(self, name):
+        attr = getattr(self._proxy, name)
+        if not callable(attr):
+            return attr
+
+        metric = 'proxy.%s.%s' % (self._service, name)
+
+        def call(*args):
+            with self._metrics.timer(metric):
+                return attr(*args)
+        return call
+
+
+# process-wide metrics, enabled by PYNAO_METRICS=1 or the --metrics option
+METRICS = Metrics(os.environ.get('PYNAO_METRICS', '0') == '1')
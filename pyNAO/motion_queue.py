@@ -0,0 +1,305 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+import collections
+import threading
+import traceback
+
+from pyNAO.metrics import METRICS
+
+
+class MotionHandle(object):
+    """ The MotionHandle class is a future-like handle for a motion submitted to a MotionQueue.
+
+    A motion function receives its handle as first argument and should use MotionHandle.sleep
+    instead of time.sleep so that it returns early once the handle gets cancelled.
+    """
+
+    PENDING   = 'pending'
+    RUNNING   = 'running'
+    DONE      = 'done'
+    CANCELLED = 'cancelled'
+    FAILED    = 'failed'
+
+
+    def __init__(self, group, func, args = ()):
+        self.group      = group
+        self._func      = func
+        self._args      = args
+        self._state     = MotionHandle.PENDING
+        self._result    = None
+        self._error     = None
+        self._callbacks = []
+        self._lock      = threading.Lock()
+        self._finished  = threading.Event()
+        self._cancelled = threading.Event()
+
+
+    @property
+    def state(self):
+        return self._state
+
+
+    def cancel(self):
+        """ This method cancels the motion. A pending motion will not be started anymore and a
+            running motion is woken up from its current sleep.
+
+        @return True if the motion was not finished yet
+        """
+        with self._lock:
+            if self._finished.is_set():
+                return False
+            self._cancelled.set()
+            if self._state != MotionHandle.PENDING:
+                return True
+
+        # a pending motion never reaches the worker, so it is finished right here
+        self._finish(MotionHandle.CANCELLED)
+        return True
+
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+
+    def done(self):
+        return self._finished.is_set()
+
+
+    def wait(self, timeout = None):
+        """ This method blocks until the motion is finished or \a timeout seconds are over.
+
+        @param timeout - float specifying the maximum time to wait in seconds (default: None)
+        @return True if the motion is finished
+        """
+        self._finished.wait(timeout)
+        return self._finished.is_set()
+
+
+    def result(self, timeout = None):
+        """ This method waits for the motion and returns the return value of the motion function.
+
+        @param timeout - float specifying the maximum time to wait in seconds (default: None)
+        @return return value of the motion function
+        """
+        if not self.wait(timeout):
+            raise RuntimeError('Motion did not finish within %s seconds' % timeout)
+
+        if self._error is not None:
+            raise self._error
+
+        return self._result
+
+
+    def addDoneCallback(self, callback):
+        """ This method registers a \a callback that gets called with the handle once the motion is
+            finished. If the motion is already finished the callback is called immediately.
+
+        @param callback - callable taking the handle as argument
+        """
+        with self._lock:
+            if not self._finished.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+
+    def sleep(self, seconds):
+        """ This method sleeps for \a seconds unless the handle gets cancelled.
+
+        @param seconds - float specifying the time to sleep in seconds
+        @return True if the full time elapsed, False if the handle was cancelled
+        """
+        self._cancelled.wait(seconds)
+        return not self._cancelled.is_set()
+
+
+    def _run(self):
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self._state = MotionHandle.RUNNING
+
+        try:
+            self._result = self._func(self, *self._args)
+        except Exception as e:
+            traceback.print_exc()
+            self._error = e
+            self._finish(MotionHandle.FAILED)
+            return
+
+        self._finish(MotionHandle.CANCELLED if self.cancelled() else MotionHandle.DONE)
+
+
+    def _finish(self, state):
+        with self._lock:
+            self._state     = state
+            callbacks       = self._callbacks
+            self._callbacks = []
+            self._finished.set()
+
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                traceback.print_exc()
+
+
+class MotionQueue(object):
+    """ The MotionQueue class executes motions of one joint group sequentially in a worker thread.
+
+    Motions for different joint groups (e.g. head and arms) should use different queues so that
+    they can run in parallel.
+    """
+
+    def __init__(self, group):
+        self.group     = group
+        self._pending  = collections.deque()
+        self._current  = None
+        self._running  = True
+        self._cond     = threading.Condition()
+        self._thread   = threading.Thread(target = self._loop, name = 'MotionQueue-%s' % group)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def submit(self, func, args = (), preempt = True):
+        """ This method enqueues a motion and returns immediately.
+
+        @param func    - callable that gets called with the handle and \a args
+        @param args    - tuple of arguments for \a func (default: ())
+        @param preempt - boolean; if True all pending and running motions get cancelled
+                         (default: True)
+        @return MotionHandle
+        """
+        handle = MotionHandle(self.group, func, args)
+
+        with self._cond:
+            if not self._running:
+                raise RuntimeError('MotionQueue %s is shut down' % self.group)
+
+            if preempt:
+                self._cancelAll()
+
+            self._pending.append(handle)
+            self._cond.notify()
+
+        return handle
+
+
+    def cancel(self):
+        """ This method cancels all pending and running motions of the queue. """
+        with self._cond:
+            self._cancelAll()
+
+
+    def shutdown(self, timeout = None):
+        """ This method cancels all motions and stops the worker thread.
+
+        @param timeout - float specifying the maximum time to wait for the worker (default: None)
+        """
+        with self._cond:
+            self._running = False
+            self._cancelAll()
+            self._cond.notify()
+
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+
+    def _cancelAll(self):
+        while self._pending:
+            self._pending.popleft().cancel()
+
+        if self._current is not None:
+            self._current.cancel()
+
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+
+                if not self._running:
+                    return
+
+                self._current = self._pending.popleft()
+
+            with METRICS.timer('motion.%s' % self.group):
+                self._current._run()
+
+            if self._current.cancelled():
+                METRICS.count('motion.%s.cancelled' % self.group)
+
+            with self._cond:
+                self._current = None
+
+
+class MotionGroup(MotionHandle):
+    """ The MotionGroup class combines several motion handles, e.g. of different motion queues, to
+        one handle that is finished once all of them are finished.
+
+    The group is done if all motions are done, failed if one of them failed and cancelled
+    otherwise. Its result is the list of the results of the motions.
+    """
+
+    def __init__(self, handles, group = 'group'):
+        MotionHandle.__init__(self, group, None)
+        self.handles    = list(handles)
+        self._remaining = len(self.handles)
+        self._state     = MotionHandle.RUNNING
+
+        if not self.handles:
+            self._finish(MotionHandle.DONE)
+
+        for handle in self.handles:
+            handle.addDoneCallback(self._onDone)
+
+
+    def cancel(self):
+        """ This method cancels all motions of the group.
+
+        @return True if the group was not finished yet
+        """
+        if self.done():
+            return False
+
+        self._cancelled.set()
+        for handle in self.handles:
+            handle.cancel()
+        return True
+
+
+    def _onDone(self, handle):
+        with self._lock:
+            self._remaining -= 1
+            if self._remaining > 0:
+                return
+
+        states = [ h.state for h in self.handles ]
+        errors = [ h._error for h in self.handles if h._error is not None ]
+
+        self._error  = errors[0] if errors else None
+        self._result = [ h._result for h in self.handles ]
+
+        if MotionHandle.FAILED in states:
+            self._finish(MotionHandle.FAILED)
+        elif MotionHandle.CANCELLED in states:
+            self._finish(MotionHandle.CANCELLED)
+        else:
+            self._finish(MotionHandle.DONE)
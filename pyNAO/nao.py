@@ -19,14 +19,18 @@ import argparse
 import math
 import time
 import sys
-
-import motion
-import vision_definitions
-from naoqi import ALProxy
-
+import threading
 
 import numpy as np
 
+from pyNAO.backend       import motion, vision_definitions
+from pyNAO               import proxy_pool
+from pyNAO.ik_table      import IKTable, direction
+from pyNAO.metrics       import METRICS
+from pyNAO.motion_queue  import MotionQueue, MotionGroup
+from pyNAO.head_tracker  import HeadTracker
+from pyNAO.state_sampler import StateSampler
+
 def magn(v):
     return math.sqrt(v[0]**2 + v[1]**2 + v[2]**2)
 
@@ -35,6 +39,11 @@ class Nao(object):
 
     LArm   = 'LArm'
     RArm   = 'RArm'
+    Head   = 'Head'
+
+    # shared instances per (ip, port), see Nao.get
+    _instances     = {}
+    _instancesLock = threading.Lock()
 
     
     OFFSET = { 'HEAD':       np.array([0.0,  0.0,  0.126]),
@@ -49,103 +58,673 @@ class Nao(object):
     Frame                  = motion.FRAME_TORSO
     AxisMask               = 7                      # just control position
     UseSensorValues        = False
+    MaxStateAge            = 0.1                    # in seconds, for cached state reads
+    PointTime              = 0.8                    # in seconds, for pointing in joint space
+    IKTolerance            = 0.1                    # in radians, for learning pointing poses
+    SettleTime             = 1.0                    # in seconds, maximum wait for a pose to settle
+    SettleTolerance        = 0.01                   # in radians, joint motion between two samples
+    JointSpeed             = 1.5                    # in rad/s, for planning timed motions
+    MinMotionTime          = 0.2                    # in seconds, for timed motions
+    HoldTime               = 2.0                    # in seconds, for gestures before returning
+    StiffnessTime          = 1.0                    # in seconds, for stiffness transitions
+
+    # joint groups with their own stiffness, see Nao.setStiffness
+    Chains                 = [ 'Head', 'LArm', 'RArm', 'LLeg', 'RLeg' ]
+
+    # joint angles of the postures in radians, used to return single joint groups to a posture
+    # whose angles were not read from the robot yet
+    PostureAngles          = { 'StandInit': { 'HeadYaw':         0.0,   'HeadPitch':      0.0,
+                                              'LShoulderPitch':  1.396, 'LShoulderRoll':  0.198,
+                                              'LElbowYaw':      -1.396, 'LElbowRoll':    -0.524,
+                                              'LWristYaw':       0.0,   'LHand':          0.25,
+                                              'RShoulderPitch':  1.396, 'RShoulderRoll': -0.198,
+                                              'RElbowYaw':       1.396, 'RElbowRoll':     0.524,
+                                              'RWristYaw':       0.0,   'RHand':          0.25,
+                                              'LHipYawPitch':    0.0,   'RHipYawPitch':   0.0,
+                                              'LHipRoll':        0.0,   'RHipRoll':       0.0,
+                                              'LHipPitch':      -0.45,  'RHipPitch':     -0.45,
+                                              'LKneePitch':      0.70,  'RKneePitch':     0.70,
+                                              'LAnklePitch':    -0.35,  'RAnklePitch':   -0.35,
+                                              'LAnkleRoll':      0.0,   'RAnkleRoll':     0.0 } }
+
+    # head joint limits in radians: (min, max)
+    HeadPitchLimits        = (-0.6720, 0.5149)
+    HeadYawLimits          = (-2.0857, 2.0857)
+
+    # pointing directions an arm can reach in radians: (min, max) of azimuth and elevation;
+    # the azimuth follows the shoulder roll limits
+    ArmWorkspace           = { 'LArm': { 'azimuth': (-0.3142, 1.3265), 'elevation': (-1.5, 1.5) },
+                               'RArm': { 'azimuth': (-1.3265, 0.3142), 'elevation': (-1.5, 1.5) } }
+
+    CAMERAS     = { 'top': 0, 'bottom': 1 }
+
+    # resolution name -> (ALVideoDevice resolution, width, height)
+    RESOLUTIONS = { 'qqvga': (vision_definitions.kQQVGA,  160, 120),
+                    'qvga':  (vision_definitions.kQVGA,   320, 240),
+                    'vga':   (vision_definitions.kVGA,    640, 480),
+                    '4vga':  (vision_definitions.k4VGA,  1280, 960) }
+
+    # colorspace name -> (ALVideoDevice colorspace, bytes per pixel)
+    COLORSPACES = { 'rgb':    (vision_definitions.kRGBColorSpace,    3),
+                    'yuv422': (vision_definitions.kYUV422ColorSpace, 2) }
 
     
-    def __init__(self, ip, port):
+    def __init__(self, ip, port, initialize = True):
+        """
+        @param ip         - string specifying the IP address of the robot
+        @param port       - integer specifying the port of the robot
+        @param initialize - True initializes the robot (stiffness and StandInit posture) before
+                            returning, 'async' in the background and False not at all; motions
+                            wait for a background initialization (default: True)
+        """
         self._ip            = ip
         self._port          = port
-        self._proxy_motion  = None
-        self._proxy_posture = None
-        self._proxy_cam     = None
-        self._stiffness     = 0.0
+        self._stiffnesses   = {}
+        self._posture       = None
+        self._postureAngles = {}
+        self._displaced     = set()
+        self._groupJoints   = {}
+        self._stateLock     = threading.Lock()
         self._videoClient   = None
-
-        self.initialize()
+        self._videoClients  = []
+        self._queues        = {}
+        self._tracker       = None
+        self._trackHandle   = None
+        self._sampler       = None
+        self._ikTables      = {}
+        self._initialized   = threading.Event()
+
+        if initialize == 'async':
+            thread        = threading.Thread(target = self.initialize, name = 'NaoInitialize')
+            thread.daemon = True
+            thread.start()
+        elif initialize:
+            self.initialize()
+        else:
+            self._initialized.set()
         
 
     def initialize(self):
-        self.stiffness = 0.6
-        self.postureProxy.goToPosture("StandInit", 0.2) 
+        try:
+            self.stiffness = 0.6
+            self.goToPosture("StandInit", 0.2) 
+        finally:
+            self._initialized.set()
+
+
+    def waitInitialized(self, timeout = None):
+        """ This method blocks until a background initialization is finished.
+
+        @param timeout - float specifying the maximum time to wait in seconds (default: None)
+        @return True if the robot is initialized
+        """
+        self._initialized.wait(timeout)
+        return self._initialized.is_set()
 
     
+    @classmethod
+    def get(cls, ip, port, initialize = True):
+        """ This method returns the Nao object shared by all modules of the process that control the
+            robot at \a ip and \a port. The robot is only initialized once.
+
+        @param ip         - string specifying the IP address of the robot
+        @param port       - integer specifying the port of the robot
+        @param initialize - True, 'async' or False, see Nao.__init__ (default: True)
+        @return Nao object
+        """
+        key = (ip, int(port))
+        with Nao._instancesLock:
+            if key not in Nao._instances:
+                Nao._instances[key] = cls(ip, int(port), initialize)
+            return Nao._instances[key]
+
+
     @property
     def motionProxy(self):
-        if self._proxy_motion is None:
-            # Set motionProxy
-            try:
-                self._proxy_motion = ALProxy("ALMotion", self._ip, self._port)
-            except Exception as e:
-                print "Could not create proxy to ALMotion"
-                print "Error was: ", e
-                sys.exit()
-        return self._proxy_motion
+        return self._getProxy("ALMotion")
+
+
+    @property
+    def memoryProxy(self):
+        return self._getProxy("ALMemory")
 
 
     @property
     def postureProxy(self):
-        if self._proxy_posture is None:
-            # Set postureProxy
-            try:
-                self._proxy_posture = ALProxy("ALRobotPosture", self._ip, self._port)
-            except Exception, e:
-                print "Could not create proxy to ALRobotPosture"
-                print "Error was: ", e
-                sys.exit()
-        return self._proxy_posture
+        return self._getProxy("ALRobotPosture")
 
 
     @property
     def camProxy(self):
-        if self._proxy_cam is None:
-            # Set camProxy
-            try:
-                self._proxy_cam = ALProxy("ALVideoDevice", self._ip, self._port)
-            except Exception as e:
-                print "Could not create proxy to ALVideoDevice"
-                print "Error was: ", e
-                sys.exit()
-        return self._proxy_cam
+        return self._getProxy("ALVideoDevice")
+
+
+    def _getProxy(self, service):
+        # proxies are shared and reconnected by the process-wide pool
+        try:
+            return proxy_pool.getProxy(self._ip, self._port, service)
+        except Exception as e:
+            print "Could not create proxy to %s" % service
+            print "Error was: ", e
+            sys.exit()
 
 
     @property
     def stiffness(self):
-        return self._stiffness
+        """ @return the commanded stiffness of all chains or None if it differs or is unknown """
+        with self._stateLock:
+            values = set( self._stiffnesses.get(chain) for chain in Nao.Chains )
+        return values.pop() if len(values) == 1 else None
     
 
     @stiffness.setter
     def stiffness(self, value):
+        self.setStiffness(value)
+
+
+    def setStiffness(self, value, chain = 'Body', duration = None):
+        """ This method sets the stiffness of a \a chain. The commanded stiffness of each chain is
+            cached and chains that already have the stiffness are skipped.
+
+        @param value    - float specifying the stiffness [0.0, 1.0]
+        @param chain    - string specifying 'Body' or a chain of Nao.Chains (default: 'Body')
+        @param duration - float specifying the transition time in seconds
+                          (default: Nao.StiffnessTime)
+        @return True if the stiffness of a chain changed
+        """
+        value    = min( max(value, 0.0), 1.0 )
+        chains   = Nao.Chains if chain == 'Body' else [chain]
+        duration = Nao.StiffnessTime if duration is None else duration
+
+        with self._stateLock:
+            changed = [ c for c in chains if self._stiffnesses.get(c) != value ]
+            for c in changed:
+                self._stiffnesses[c] = value
+
+        if not changed:
+            METRICS.count('stiffness.skipped')
+            return False
+
+        try:
+            # We use the "Body" name to signify the collection of all joints
+            if len(changed) == len(Nao.Chains):
+                self.motionProxy.stiffnessInterpolation("Body", value, duration)
+            else:
+                self.motionProxy.stiffnessInterpolation(changed, [value] * len(changed),
+                                                        [duration] * len(changed))
+        except Exception:
+            self.invalidateState()
+            raise
+
+        return True
+
 
-        # We use the "Body" name to signify the collection of all joints
-        self._stiffness = min( max(value, 0.0), 1.0 )
-        self.motionProxy.stiffnessInterpolation("Body", self._stiffness, 1.0)
+    def getStiffness(self, chain):
+        """ @return the commanded stiffness of \a chain or None if it is unknown """
+        return self._stiffnesses.get(chain)
 
 
-    def moveHead(self, pitch, yaw, sleepTime):
+    @property
+    def posture(self):
+        """ @return name of the last posture if no joint group moved since, None otherwise """
+        return self._posture if not self._displaced else None
+
+
+    def goToPosture(self, name, speed = 0.2, groups = None, handle = None):
+        """ This method moves the robot into the posture \a name. Nothing happens if the robot
+            is already there. If the robot was in the posture before and only some joint groups
+            moved, just these groups return to the angles of the posture.
+
+        @param name   - string specifying the posture, e.g. 'StandInit'
+        @param speed  - float specifying the fraction of the maximum speed; returning groups move
+                        at Nao.JointSpeed (default: 0.2)
+        @param groups - list of joint groups that should return; the other groups are left where
+                        they are. If the posture is not cached, the groups return to the angles
+                        of Nao.PostureAngles (default: all groups)
+        @param handle - MotionHandle; returning groups stop if it gets cancelled (default: None)
+        @return True if the posture was reached
+        """
+        with self._stateLock:
+            known     = self._posture == name and name in self._postureAngles
+            displaced = set(self._displaced if groups is None else 
+                            self._displaced.intersection(groups))
+
+        if known and not displaced:
+            METRICS.count('posture.skipped')
+            return True
+
+        if known:
+            postureAngles = self._postureAngles[name]
+        elif groups is not None:
+            # a full body posture change would move the groups of the other motion queues
+            if name not in Nao.PostureAngles:
+                return False
+            postureAngles = Nao.PostureAngles[name]
+            displaced     = set(groups)
+
+        if known or groups is not None:
+            joints = [ joint for group in sorted(displaced)
+                       for joint in self._getGroupJoints(group) ]
+            angles = [ postureAngles[joint] for joint in joints ]
+            period = self.motionTime(joints, angles)
+            if not self._interpolate(handle, period, 'angleInterpolation', joints, angles, period,
+                                     True):
+                return False
+            with self._stateLock:
+                self._displaced -= displaced
+            return True
+
+        if not self.postureProxy.goToPosture(name, speed):
+            self.invalidateState()
+            return False
+
+        joints = self._getGroupJoints('Body')
+        angles = self.motionProxy.getAngles('Body', False)
+        with self._stateLock:
+            self._posture             = name
+            self._postureAngles[name] = dict(zip(joints, angles))
+            self._displaced.clear()
+        return True
+
+
+    def markMoved(self, group):
+        """ This method records that the joints of \a group left the current posture.
+
+        @param group - string specifying the joint group, e.g. Nao.Head, Nao.LArm or Nao.RArm
+        """
+        with self._stateLock:
+            self._displaced.add(group)
+
+
+    def invalidateState(self):
+        """ This method forgets the cached stiffnesses and posture, e.g. after the robot was moved
+            by another client.
+        """
+        with self._stateLock:
+            self._stiffnesses.clear()
+            self._posture = None
+            self._displaced.clear()
+
+
+    def _getGroupJoints(self, group):
+        if group not in self._groupJoints:
+            self._groupJoints[group] = self.motionProxy.getBodyNames(group)
+        return self._groupJoints[group]
+
+
+    def motionQueue(self, group):
+        """ This method returns the motion queue for the joint \a group. Each group has its own
+            worker thread so that head and arm motions do not block each other.
+
+        @param group - string specifying the joint group, e.g. Nao.Head, Nao.LArm or Nao.RArm
+        @return MotionQueue
+        """
+        # the Nao object is shared between threads, so two first motions of a group may race
+        with self._stateLock:
+            if group not in self._queues:
+                self._queues[group] = MotionQueue(group)
+            return self._queues[group]
+
+
+    def moveHead(self, pitch, yaw, sleepTime, handle = None):
+        self.markMoved(Nao.Head)
         self.motionProxy.setAngles(["HeadPitch", "HeadYaw"], [pitch, yaw], 0.1)
-        time.sleep(sleepTime)
+        return self._sleep(sleepTime, handle)
 
 
-    def moveArm(self, arm, target, sleepTime):
+    def moveArm(self, arm, target, sleepTime, handle = None):
         assert arm in [Nao.LArm, Nao.RArm], "Error: arm needs to be 'LArm' or 'RArm'"
 
+        self.markMoved(arm)
         self.motionProxy.setPosition(arm, Nao.Frame, target, 0.9, Nao.AxisMask)
-        time.sleep(sleepTime)
+        return self._sleep(sleepTime, handle)
+
 
-    
     def look(self, vector):
-        pitch, yaw      = self.getPitchAndYaw(vector)
-        sleepTime       = 2                     # seconds
-        self.moveHead(pitch, yaw, sleepTime)    # Move head to look
-        self.moveHead(0,     0,   sleepTime)    # Move head back
+        """ This method lets the robot look at \a vector and returns immediately. A newer look
+            supersedes the current one.
+
+        @param vector - fixation point [x, y, z] in the torso frame
+        @return MotionHandle
+        """
+        return self.motionQueue(Nao.Head).submit(self._look, (vector,))
 
 
     def point(self, arm, vector):
+        """ This method lets the robot point with \a arm at \a vector and returns immediately. A
+            newer point with the same arm supersedes the current one.
+
+        @param arm    - string specifying the arm, Nao.LArm or Nao.RArm
+        @param vector - target point [x, y, z] in the torso frame
+        @return MotionHandle
+        """
         assert arm in [Nao.LArm, Nao.RArm], "Error: arm needs to be 'LArm' or 'RArm'"
+        return self.motionQueue(arm).submit(self._point, (arm, vector))
+
+
+    def plan(self, actions):
+        """ This method executes several actions as one motion plan and returns immediately. The
+            actions of a joint group are executed in the given order, different joint groups in
+            parallel. The plan supersedes the current motions of the joint groups it uses.
+
+        @param actions - list of ('look', vector) and ('point', arm, vector) tuples
+        @return MotionGroup
+        """
+        handles = []
+        groups  = set()
+
+        for action in actions:
+            if action[0] == 'look':
+                group, func, args = Nao.Head, self._look, (action[1],)
+            elif action[0] == 'point':
+                assert action[1] in [Nao.LArm, Nao.RArm], "Error: arm needs to be 'LArm' or 'RArm'"
+                group, func, args = action[1], self._point, (action[1], action[2])
+            else:
+                raise ValueError('Unknown action: %s' % action[0])
+
+            # only the first action of a group supersedes, the others are queued behind it
+            preempt = group not in groups
+            handles.append(self.motionQueue(group).submit(func, args, preempt = preempt))
+            groups.add(group)
+
+        return MotionGroup(handles, 'plan')
+
+
+    def schedule(self, motions, duration):
+        """ This method runs motions of different joint groups in parallel, so that they reach
+            their targets at a shared deadline. Each motion function is called with its handle,
+            the time left until the deadline and its arguments, and should move its joints within
+            that time (e.g. with angleInterpolation).
+
+        @param motions  - list of (group, func, args) tuples, one per joint group
+        @param duration - float specifying the time until the deadline in seconds
+        @return MotionGroup
+        """
+        deadline = time.time() + duration
+
+        def timed(handle, func, *args):
+            return func(handle, max(deadline - time.time(), Nao.MinMotionTime), *args)
+
+        handles = [ self.motionQueue(group).submit(timed, (func,) + tuple(args))
+                    for group, func, args in motions ]
+        return MotionGroup(handles, 'schedule')
+
+
+    def lookPoint(self, arm, vector, duration = None):
+        """ This method lets the robot look and point with \a arm at \a vector at the same time
+            and returns immediately. Head and arm arrive together after \a duration seconds, hold
+            the gesture for Nao.HoldTime seconds and return.
+
+        @param arm      - string specifying the arm, Nao.LArm or Nao.RArm
+        @param vector   - target point [x, y, z] in the torso frame
+        @param duration - float specifying the time to reach the target in seconds
+                          (default: the time of the slower chain at Nao.JointSpeed)
+        @return MotionGroup
+        """
+        assert arm in [Nao.LArm, Nao.RArm], "Error: arm needs to be 'LArm' or 'RArm'"
+
+        pitches, yaws, _      = self.getPitchesAndYaws([vector])
+        head                  = [ float(pitches[0]), float(yaws[0]) ]
+        table                 = self.ikTable(arm)
+        azimuth, elevation, _ = direction(vector, Nao.OFFSET[arm[0] + 'Shoulder'])
+        angles                = table.lookup(azimuth[0], elevation[0])
+
+        if duration is None:
+            armTime  = Nao.PointTime if angles is None else self.motionTime(table.joints, angles)
+            duration = max(self.motionTime(['HeadPitch', 'HeadYaw'], head), armTime)
+
+        return self.schedule([ (Nao.Head, self._timedLook,  (head,)),
+                               (arm,      self._timedPoint, (arm, vector, angles)) ], duration)
+
+
+    def motionTime(self, joints, angles):
+        """ This method estimates the time to move \a joints to \a angles at Nao.JointSpeed.
+
+        @param joints - list of joint names
+        @param angles - list of target angles in radians
+        @return time in seconds, at least Nao.MinMotionTime
+        """
+        state   = self.getState(Nao.MaxStateAge)
+        if state is not None:
+            current = [ state.getAngle(joint) for joint in joints ]
+        else:
+            current = self.motionProxy.getAngles(joints, True)
+
+        distance = np.abs(np.asarray(angles) - current).max()
+        return max(distance / Nao.JointSpeed, Nao.MinMotionTime)
+
+
+    def _timedLook(self, handle, timeLeft, head):
+        self.waitInitialized()
+
+        self.markMoved(Nao.Head)
+        if self._interpolate(handle, timeLeft, 'angleInterpolation', ["HeadPitch", "HeadYaw"],
+                             head, timeLeft, True) and self._sleep(Nao.HoldTime, handle):
+            self.moveHead(0, 0, 0, handle)
+
+
+    def _timedPoint(self, handle, timeLeft, arm, vector, angles):
+        self.waitInitialized()
+        self.markMoved(arm)
+
+        if angles is not None:
+            METRICS.count('ik.hit')
+            moved  = self._interpolate(handle, timeLeft, 'angleInterpolation',
+                                       self.ikTable(arm).joints, angles, timeLeft, True)
+        else:
+            METRICS.count('ik.miss')
+            target = self.getTarget(vector, Nao.OFFSET[arm[0] + 'Shoulder'])
+            moved  = self._interpolate(handle, timeLeft, 'positionInterpolations', [arm],
+                                       Nao.Frame, [target], [Nao.AxisMask], [timeLeft])
+
+        if not moved:
+            return
 
-        target = self.getTarget(vector, Nao.OFFSET[arm[0] + 'Shoulder'])
-        self.moveArm(arm, target,        .1)   # Move arm to point
         self.openHand(arm)
-        self.postureProxy.goToPosture("StandInit", 0.2) 
+        if angles is None:
+            azimuth, elevation, _ = direction(vector, Nao.OFFSET[arm[0] + 'Shoulder'])
+            state                 = self.settledState(arm, handle)
+            if state is not None:
+                self.learnPointing(arm, azimuth[0], elevation[0], state)
+
+        if self._sleep(Nao.HoldTime, handle):
+            self.goToPosture("StandInit", 0.2, [arm], handle)
+
+
+    def startTracking(self, **kwargs):
+        """ This method starts the head tracking mode. The head follows the fixation points given to
+            track() until stopTracking() is called or a look() supersedes the tracking.
+
+        @param kwargs - keyword arguments for the HeadTracker
+        @return MotionHandle
+        """
+        self._tracker     = HeadTracker(self, **kwargs)
+        self._trackHandle = self.motionQueue(Nao.Head).submit(self._tracker.run)
+        return self._trackHandle
+
+
+    def track(self, vector):
+        """ This method updates the fixation point of the head tracking mode.
+
+        @param vector - fixation point [x, y, z] in the torso frame
+        @return True if the tracking mode is active
+        """
+        if self._trackHandle is None or self._trackHandle.done():
+            return False
+
+        self._tracker.update(vector)
+        return True
+
+
+    def stopTracking(self):
+        if self._trackHandle is not None:
+            self._trackHandle.cancel()
+            self._trackHandle = None
+
+
+    def stop(self):
+        """ This method cancels all pending and running motions and halts the robot. Cancelling
+            the queues alone would let the motion tasks already sent to NAOqi run to their end.
+        """
+        self.stopTracking()
+        for queue in self._queues.values():
+            queue.cancel()
+        self.motionProxy.killAll()
+
+
+    def _look(self, handle, vector):
+        self.waitInitialized()
+
+        pitch, yaw      = self.getPitchAndYaw(vector)
+        sleepTime       = 2                             # seconds
+
+        # Move head to look and back unless a newer target superseded this one
+        if self.moveHead(pitch, yaw, sleepTime, handle):
+            self.moveHead(0, 0, sleepTime, handle)
+
+
+    def _point(self, handle, arm, vector):
+        self.waitInitialized()
+
+        shoulderOffset          = Nao.OFFSET[arm[0] + 'Shoulder']
+        table                   = self.ikTable(arm)
+        azimuth, elevation, _   = direction(vector, shoulderOffset)
+        angles                  = table.lookup(azimuth[0], elevation[0])
+
+        # Move arm to point; in joint space if the IK table knows a pose for the direction
+        if angles is not None:
+            METRICS.count('ik.hit')
+            self.markMoved(arm)
+            moved = self._interpolate(handle, Nao.PointTime, 'angleInterpolation', table.joints,
+                                      angles, Nao.PointTime, True) and self._sleep(.1, handle)
+        else:
+            METRICS.count('ik.miss')
+            moved = self.moveArm(arm, self.getTarget(vector, shoulderOffset), .1, handle)
+
+        if moved:
+            self.openHand(arm)
+            if angles is None:
+                state = self.settledState(arm, handle)
+                if state is not None:
+                    self.learnPointing(arm, azimuth[0], elevation[0], state)
+            self.goToPosture("StandInit", 0.2, [arm], handle)
+
+
+    def ikTable(self, arm):
+        """ This method returns the IK lookup table of \a arm.
+
+        @param arm - string specifying the arm, Nao.LArm or Nao.RArm
+        @return IKTable
+        """
+        if arm not in self._ikTables:
+            joints = [ joint for joint in self.motionProxy.getBodyNames(arm)
+                       if not joint.endswith('Hand') ]
+            self._ikTables[arm] = IKTable(arm, joints, Nao.ArmWorkspace[arm])
+        return self._ikTables[arm]
+
+
+    def settledState(self, arm, handle = None, timeout = None):
+        """ This method samples the robot state until the joints of \a arm moved less than
+            Nao.SettleTolerance between two samples.
+
+        @param arm     - string specifying the arm, Nao.LArm or Nao.RArm
+        @param handle  - MotionHandle; waiting stops if it gets cancelled (default: None)
+        @param timeout - float specifying the maximum wait in seconds (default: Nao.SettleTime)
+        @return RobotState of the settled arm or None if it did not settle in time
+        """
+        joints   = self.ikTable(arm).joints
+        sampler  = StateSampler(self)
+        deadline = time.time() + (Nao.SettleTime if timeout is None else timeout)
+        previous = None
+
+        while True:
+            state  = sampler.sample()
+            angles = np.array([ state.getAngle(joint) for joint in joints ])
+            if previous is not None and np.abs(angles - previous).max() < Nao.SettleTolerance:
+                return state
+            if time.time() >= deadline or not self._sleep(0.05, handle):
+                return None
+            previous = angles
+
+
+    def learnPointing(self, arm, azimuth = None, elevation = None, state = None):
+        """ This method stores the pose of \a arm in its IK table if the arm is stretched and,
+            if a direction is given, points to it within Nao.IKTolerance. Position and joint angles
+            are taken from the same robot state, so they belong to the same pose.
+
+        @param arm       - string specifying the arm, Nao.LArm or Nao.RArm
+        @param azimuth   - float specifying the requested azimuth in radians   (default: None)
+        @param elevation - float specifying the requested elevation in radians (default: None)
+        @param state     - RobotState of the settled arm; sampled now if None  (default: None)
+        @return True if the pose was stored
+        """
+        table          = self.ikTable(arm)
+        state          = state or StateSampler(self).sample()
+        position       = state.positions[arm]
+        actual         = direction(position[:3], Nao.OFFSET[arm[0] + 'Shoulder'])
+        actual         = [ values[0] for values in actual ]
+
+        if actual[2] < 0.9 * Nao.ArmLength:
+            return False
+        if azimuth is not None and \
+                math.hypot(actual[0] - azimuth, actual[1] - elevation) > Nao.IKTolerance:
+            return False
+
+        angles         = [ state.getAngle(joint) for joint in table.joints ]
+        return table.learn(actual[0], actual[1], angles)
+
+
+    def calibratePointing(self, arm, settle = None):
+        """ This method fills the IK table of \a arm by pointing to the center of each cell. This
+            takes up to \a settle seconds per cell and should be done before a session.
+
+        @param arm    - string specifying the arm, Nao.LArm or Nao.RArm
+        @param settle - float specifying the maximum time to reach a pose in seconds
+                        (default: Nao.SettleTime)
+        @return number of learned poses
+        """
+        shoulderOffset = Nao.OFFSET[arm[0] + 'Shoulder']
+        learned        = 0
+
+        for azimuth, elevation in self.ikTable(arm).centers():
+            unit   = [ math.cos(elevation) * math.cos(azimuth),
+                       math.cos(elevation) * math.sin(azimuth),
+                       math.sin(elevation) ]
+            self.moveArm(arm, self.getTarget(shoulderOffset + unit, shoulderOffset), 0)
+            state    = self.settledState(arm, timeout = settle)
+            if state is not None:
+                learned += self.learnPointing(arm, azimuth, elevation, state)
+
+        self.goToPosture("StandInit", 0.2, [arm])
+        return learned
+
+
+    @staticmethod
+    def _sleep(sleepTime, handle):
+        if handle is None:
+            time.sleep(sleepTime)
+            return True
+        return handle.sleep(sleepTime)
+
+
+    def _interpolate(self, handle, duration, method, *args):
+        """ This method posts the ALMotion call \a method, so that it runs on the robot while
+            this thread waits on \a handle. A cancelled handle stops the posted task.
+
+        @param handle   - MotionHandle or None
+        @param duration - float specifying the duration of the motion in seconds
+        @param method   - string specifying the ALMotion method, e.g. 'angleInterpolation'
+        @param args     - arguments of the ALMotion method
+        @return True if the motion finished, False if it got cancelled
+        """
+        taskId = getattr(self.motionProxy.post, method)(*args)
+
+        if not self._sleep(duration, handle):
+            self.motionProxy.stop(taskId)
+            return False
+
+        self.motionProxy.wait(taskId, 0)
+        return True
 
 
 
@@ -177,6 +756,70 @@ class Nao(object):
         return pitch, yaw
 
 
+    def getTargets(self, vectors, arm):
+        """ This method is the vectorized version of getTarget. The pointing directions are clamped
+            to the workspace of the \a arm given by Nao.ArmWorkspace.
+
+        @param vectors - array of shape (N, 3) with target points in the torso frame
+        @param arm     - string specifying the arm, Nao.LArm or Nao.RArm
+        @return array of shape (N, 6) with arm targets, boolean array of shape (N,) which is False
+                for targets that had to be clamped
+        """
+        assert arm in [Nao.LArm, Nao.RArm], "Error: arm needs to be 'LArm' or 'RArm'"
+
+        shoulderOffset  = Nao.OFFSET[arm[0] + 'Shoulder']
+        workspace       = Nao.ArmWorkspace[arm]
+
+        # vectors from shoulder to objects as azimuth and elevation
+        vectors         = np.asarray(vectors, dtype = np.float64).reshape(-1, 3) - shoulderOffset
+        azimuth         = np.arctan2(vectors[:, 1], vectors[:, 0])
+        elevation       = np.arctan2(vectors[:, 2], np.hypot(vectors[:, 0], vectors[:, 1]))
+
+        clampedAzimuth   = np.clip(azimuth,   *workspace['azimuth'])
+        clampedElevation = np.clip(elevation, *workspace['elevation'])
+        reachable        = (clampedAzimuth == azimuth) & (clampedElevation == elevation) & \
+                           np.any(vectors != 0.0, axis = 1)
+
+        # directions scaled by arm length in torso coordinate frame
+        targets          = np.zeros((len(vectors), 6))
+        cosElevation     = np.cos(clampedElevation)
+        targets[:, 0]    = cosElevation * np.cos(clampedAzimuth)
+        targets[:, 1]    = cosElevation * np.sin(clampedAzimuth)
+        targets[:, 2]    = np.sin(clampedElevation)
+        targets[:, :3]   = targets[:, :3] * Nao.ArmLength + shoulderOffset
+
+        return targets, reachable
+
+
+    def getPitchesAndYaws(self, vectors):
+        """ This method is the vectorized version of getPitchAndYaw. The angles are clamped to the
+            head joint limits.
+
+        @param vectors - array of shape (N, 3) with fixation points in the torso frame
+        @return pitch array of shape (N,), yaw array of shape (N,), boolean array of shape (N,)
+                which is False for fixation points that had to be clamped; fixation points at the
+                head origin have no direction and get pitch and yaw 0
+        """
+        # Get unit vectors from head to objects; points at the head origin look straight ahead
+        vectors     = np.asarray(vectors, dtype = np.float64).reshape(-1, 3) - Nao.OFFSET['HEAD']
+        norms       = np.linalg.norm(vectors, axis = 1)
+        degenerate  = norms < 1e-9
+        vectors[degenerate] = [1.0, 0.0, 0.0]
+        norms[degenerate]   = 1.0
+        unitVectors = vectors / norms[:, np.newaxis]
+
+        # Compute pitch and yaw of unit vectors
+        pitch       = -np.arcsin(unitVectors[:, 2])
+        yaw         = np.arccos(unitVectors[:, 0])
+        yaw[unitVectors[:, 1] < 0] *= -1
+
+        clampedPitch = np.clip(pitch, *Nao.HeadPitchLimits)
+        clampedYaw   = np.clip(yaw,   *Nao.HeadYawLimits)
+        reachable    = (clampedPitch == pitch) & (clampedYaw == yaw) & ~degenerate
+
+        return clampedPitch, clampedYaw, reachable
+
+
     def openHand(self, arm):
         self.motionProxy.openHand(arm[0] + 'Hand')
 
@@ -185,28 +828,104 @@ class Nao(object):
         self.motionProxy.closeHand(arm[0] + 'Hand')
 
 
-    def getPosition(self, joint):
+    def getPosition(self, joint, maxAge = None):
+        """ This method returns the position of an effector. If the state sampler runs and has a
+            state that is not older than \a maxAge, the cached position is returned.
+
+        @param joint  - string specifying the effector, e.g. 'Head', 'LArm' or 'RArm'
+        @param maxAge - float specifying the maximum age of a cached position in seconds
+                        (default: Nao.MaxStateAge)
+        @return position [x, y, z, wx, wy, wz] in the torso frame
+        """
+        if self._sampler is not None:
+            state = self._sampler.latest(Nao.MaxStateAge if maxAge is None else maxAge)
+            if state is not None and joint in state.positions:
+                return state.positions[joint]
+
         return self.motionProxy.getPosition(joint, Nao.Frame, True)
 
 
-    def startVision(self):
-        self.camProxy.setActiveCamera(1)
-        self._videoClient = self.camProxy.subscribe( '_client3', 
-                                                     vision_definitions.kQVGA,
-                                                     vision_definitions.kRGBColorSpace,
-                                                     30 )
+    def getState(self, maxAge = None):
+        """ This method returns the latest state of the state sampler.
+
+        @param maxAge - float specifying the maximum age in seconds (default: None)
+        @return RobotState or None if the sampler does not run or has no state young enough
+        """
+        return None if self._sampler is None else self._sampler.latest(maxAge)
+
+
+    def startStateSampler(self, rate = 20.0, history = 100, useSensors = True):
+        """ This method starts the background state sampler unless it is already running.
+
+        @param rate       - float specifying the sampling rate in Hz      (default: 20.0)
+        @param history    - integer specifying the ring buffer size       (default: 100)
+        @param useSensors - boolean; read sensor instead of command values (default: True)
+        @return StateSampler
+        """
+        if self._sampler is None:
+            self._sampler = StateSampler(self, rate, history, useSensors)
+            self._sampler.start()
+        return self._sampler
+
+
+    def stopStateSampler(self):
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._sampler = None
+
+
+    def startVision(self, camera = 'bottom', resolution = 'qvga', colorspace = 'rgb', fps = 30, 
+                    name = '_client3'):
+        """ This method subscribes to a camera stream. Several streams, e.g. one for each camera,
+            can be subscribed at the same time.
+
+        @param camera     - string specifying the camera, 'top' or 'bottom'  (default: 'bottom')
+        @param resolution - string specifying a key of Nao.RESOLUTIONS       (default: 'qvga')
+        @param colorspace - string specifying a key of Nao.COLORSPACES       (default: 'rgb')
+        @param fps        - integer specifying the camera frame rate         (default: 30)
+        @param name       - string specifying the subscriber name            (default: '_client3')
+        @return video client handle
+        """
+        client = self.camProxy.subscribeCamera( name,
+                                                Nao.CAMERAS[camera],
+                                                Nao.RESOLUTIONS[resolution][0],
+                                                Nao.COLORSPACES[colorspace][0],
+                                                fps )
+        self._videoClients.append(client)
+        self._videoClient = client
+        return client
+
+
+    def stopVision(self, client = None):
+        """ This method unsubscribes the video \a client or all video clients if none is given.
+
+        @param client - video client handle as returned by startVision (default: None)
+        """
+        clients = self._videoClients if client is None else [client]
+
+        for video_client in list(clients):
+            self.camProxy.unsubscribe(video_client)
+            self._videoClients.remove(video_client)
+
+        if self._videoClient not in self._videoClients:
+            self._videoClient = self._videoClients[-1] if self._videoClients else None
 
-    def stopVision(self):
-        if self._videoClient:
-            self.camProxy.unsubscribe(self._videoClient)
 
+    def getImage(self, client = None):
+        """ This method returns the latest image of the video \a client.
 
-    def getImage(self):
-        return self.camProxy.getImageRemote(self._videoClient)
+        @param client - video client handle (default: the most recently started one)
+        @return image as returned by ALVideoDevice.getImageRemote
+        """
+        return self.camProxy.getImageRemote(client or self._videoClient)
 
 
     def __del__(self):
-        self.stopVision()
+        self.stopStateSampler()
+        for queue in self._queues.values():
+            queue.shutdown(0)
+        if self._videoClients:
+            self.stopVision()
 
 
 ####################################################################################################
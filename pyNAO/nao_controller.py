@@ -15,53 +15,293 @@
 #    You should have received a copy of the GNU Affero General Public License                      #
 #    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
 ####################################################################################################
-from pyNAO.BaseModule   import BaseModule, main
+import yarp
+
+from pyNAO.BaseModule           import BaseModule, main, EMSG_YARP_NOT_FOUND
+from pyNAO.command_dispatcher   import CommandDispatcher
+from pyNAO.metrics              import METRICS
+
+
+USAGE = 'commands: look x y z | point <"left"|"right"> x y z | ' \
+        'lookpoint <"left"|"right"> x y z [seconds] | track <"start"|"stop"|x y z> | ' \
+        'batch (<look|point> ...) ... | stop | status <id> | stats'
+
+ARMS        = { 'left': 'LArm', 'right': 'RArm' }
+
+VOCAB_LOOK      = yarp.Vocab.encode('look')
+VOCAB_POINT     = yarp.Vocab.encode('poin')
+VOCAB_LOOKPOINT = yarp.Vocab.encode('lkpt')
 
 
 class NaoController(BaseModule):
     """ The NaoController class provides a yarp module to control the Nao robot.
+
+    In tracking mode the fixation points are read from the streaming port /<name>/track:i.
+
+    Commands are dispatched through a table keyed by the command name and, for binary clients, by
+    the command vocab (e.g. VOCAB4('p','o','i','n') for point). The stats command is only available
+    by name.
     """
 
+    # command name -> (handler method, vocab)
+    COMMANDS = { 'look':      ('_parseLook',      'look'),
+                 'point':     ('_parsePoint',     'poin'),
+                 'lookpoint': ('_parseLookPoint', 'lkpt'),
+                 'track':     ('_parseTrack',     'trac'),
+                 'stop':      ('_parseStop',      'stop'),
+                 'batch':     ('_parseBatch',     'batc'),
+                 'status':    ('_respondStatus',  'stat'),
+                 'stats':     ('_respondStats',   None) }
+
+
+    def __init__(self, ip, port, prefix):
+        BaseModule.__init__(self, ip, port, prefix)
+
+        # dispatch table: command name and command vocab -> bound handler
+        self.handlers = {}
+        for name, (method, vocab) in NaoController.COMMANDS.items():
+            handler = getattr(self, method)
+            self.handlers[name] = handler
+            if vocab is not None:
+                self.handlers[yarp.Vocab.encode(vocab)] = handler
+
+
+    def configure(self, rf):
+        # BaseModule.configure attaches the RPC port before it connects to the robot, so everything
+        # respond uses has to exist before
+        self.dispatcher = CommandDispatcher()
+        self.track_port = yarp.BufferedPortBottle()
+
+        try:
+            BaseModule.configure(self, rf)
+        except:
+            self.dispatcher.shutdown()
+            raise
+
+        if not self.track_port.open('/%s/track:i' % self.getName()):
+            raise RuntimeError, EMSG_YARP_NOT_FOUND
+
+        return True
+
+
+    def interruptModule(self):
+        self.track_port.interrupt()
+        return BaseModule.interruptModule(self)
+
+
+    def close(self):
+        self.dispatcher.shutdown()
+        self.nao.stopTracking()
+        self.track_port.close()
+        return BaseModule.close(self)
+
+
+    def getPeriod(self):
+        # the tracking port is read in updateModule
+        return 0.02
+
+
+    def updateModule(self):
+        # only the latest fixation point is of interest
+        bottle = None
+        while self.track_port.getPendingReads() > 0:
+            bottle = self.track_port.read(False)
+
+        if bottle is not None and bottle.size() >= 3:
+            self.nao.track([ bottle.get(0).asDouble(), 
+                             bottle.get(1).asDouble(),
+                             bottle.get(2).asDouble() ])
+
+        return BaseModule.updateModule(self)
+
+
     def respond(self, command, reply):
         """ This is the respond hook method which gets called upon receiving a bottle via RPC port.
 
+        Commands are only parsed here and executed by the dispatcher. The reply is 'ack <id>' or
+        'nack <message>'; 'status <id>' replies 'ack <id> <state> <milliseconds>'.
+
         @param command - input bottle
         @param reply - output bottle
         @return boolean
         """
-        reply = 'nack'
+        with METRICS.timer('rpc.respond'):
+            return self._respond(command, reply)
 
+
+    def _respond(self, command, reply):
         try:
-            if command.get(0).toString() == 'point':
-    
-                arm   = command.get(1).toString()
-    
-                if arm not in ['left', 'right']:
-                    reply += ' message format for point: point <"left"|"right"> x y z'
-    
-                else:
-                    xyz   = [ command.get(2).asDouble(), 
-                              command.get(3).asDouble(),
-                              command.get(4).asDouble() ] 
-                    self.nao.point('LArm' if arm == 'left' else 'RArm', xyz)
-                    reply = 'ack'
-    
-            elif command.get(0).toString() == 'look':
-                    xyz = [ command.get(1).asDouble(), 
-                            command.get(2).asDouble(),
-                            command.get(3).asDouble(),
-                            ] 
-                    
-                    self.nao.look(xyz)
-                    reply = 'ack'
+            handler = self.handlers.get(commandKey(command.get(0)))
+
+            if handler in (self._respondStats, self._respondStatus):
+                return handler(command, reply)
+
+            if self.nao is None:
+                reply.addString('nack')
+                reply.addString('initializing')
+                return True
+
+            parsed = None if handler is None else handler(command)
+
         except Exception as e:
             print e
+            parsed = None
 
+        if parsed is None:
+            reply.addString('nack')
+            reply.addString(USAGE)
+            return True
 
-        # reply with success
-#        reply.addString('ack')
+        name, func, priority = parsed
+        request = self.dispatcher.submit( name, func, priority, 
+                                          preempt = priority == CommandDispatcher.PRIORITY_HIGH )
+
+        reply.addString('ack')
+        reply.addInt(request.id)
         return True
 
 
+    def _respondStats(self, command, reply):
+        return BaseModule.respond(self, command, reply)
+
+
+    def _respondStatus(self, command, reply):
+        request = self.dispatcher.status(command.get(1).asInt())
+
+        if request is None:
+            reply.addString('nack')
+            reply.addString('unknown request id')
+        else:
+            reply.addString('ack')
+            reply.addInt(request.id)
+            reply.addString(request.state)
+            reply.addDouble(request.duration * 1000.0)
+        return True
+
+
+    def _parsePoint(self, command):
+        action = parseAction(command)
+        if action is None:
+            return None
+
+        _, arm, xyz = action
+        return 'point', lambda: self.nao.point(arm, xyz), CommandDispatcher.PRIORITY_NORMAL
+
+
+    def _parseLook(self, command):
+        xyz = parseVector(command, 1)
+        if xyz is None:
+            return None
+        return 'look', lambda: self.nao.look(xyz), CommandDispatcher.PRIORITY_NORMAL
+
+
+    def _parseLookPoint(self, command):
+        action = parseAction(command)
+        if action is None:
+            return None
+
+        _, arm, xyz = action
+        duration    = None
+
+        # lookpoint <arm> x y z <seconds> or lookpoint <arm> (x y z) <seconds>
+        if command.size() == 6 or (command.size() == 4 and command.get(2).isList()):
+            duration = command.get(command.size() - 1).asDouble()
+            if duration <= 0:
+                return None
+
+        return 'lookpoint', lambda: self.nao.lookPoint(arm, xyz, duration), \
+               CommandDispatcher.PRIORITY_NORMAL
+
+
+    def _parseTrack(self, command):
+        normal = CommandDispatcher.PRIORITY_NORMAL
+
+        if command.get(1).toString() == 'start':
+            return 'track', self.nao.startTracking, normal
+
+        elif command.get(1).toString() == 'stop':
+            return 'track', self.nao.stopTracking, normal
+
+        xyz = parseVector(command, 1)
+        if xyz is None:
+            return None
+        return 'track', lambda: self.nao.track(xyz), normal
+
+
+    def _parseStop(self, command):
+        # preempts all queued and running commands
+        return 'stop', self.nao.stop, CommandDispatcher.PRIORITY_HIGH
+
+
+    def _parseBatch(self, command):
+        actions = []
+        for i in range(1, command.size()):
+            item = command.get(i).asList()
+            if item is None:
+                return None
+
+            action = parseAction(item)
+            if action is None or action[0] == 'lookpoint':
+                return None
+            actions.append(action)
+
+        if not actions:
+            return None
+        return 'batch', lambda: self.nao.plan(actions), CommandDispatcher.PRIORITY_NORMAL
+
+
+def commandKey(value):
+    """ This method returns the dispatch key of a command element: the vocab for vocab elements,
+        the string otherwise.
+
+    @param value - yarp.Value
+    @return integer or string
+    """
+    if value.isVocab():
+        return value.asVocab()
+    return value.asString()
+
+
+def parseVector(bottle, index):
+    """ This method reads a vector given either as x y z elements or as list (x y z).
+
+    @param bottle - yarp.Bottle
+    @param index  - integer specifying the index of the first element
+    @return [x, y, z] or None if there are less than 3 numbers
+    """
+    value = bottle.get(index)
+    if value.isList():
+        bottle, index = value.asList(), 0
+
+    values = [ bottle.get(index + i) for i in range(3) ]
+    if not all(value.isInt() or value.isDouble() for value in values):
+        return None
+    return [ value.asDouble() for value in values ]
+
+
+def parseAction(bottle):
+    """ This method parses a motion action: 'look x y z', 'point <"left"|"right"> x y z' or
+        'lookpoint <"left"|"right"> x y z'.
+
+    @param bottle - yarp.Bottle
+    @return ('look', vector), ('point', arm, vector), ('lookpoint', arm, vector) or None if the
+            action is invalid
+    """
+    name = commandKey(bottle.get(0))
+
+    if name in ('look', VOCAB_LOOK):
+        vector = parseVector(bottle, 1)
+        return None if vector is None else ('look', vector)
+
+    elif name in ('point', VOCAB_POINT, 'lookpoint', VOCAB_LOOKPOINT):
+        arm    = bottle.get(1).toString()
+        vector = parseVector(bottle, 2)
+        if arm not in ARMS or vector is None:
+            return None
+        return ('point' if name in ('point', VOCAB_POINT) else 'lookpoint'), ARMS[arm], vector
+
+    return None
+
+
 if __name__ == '__main__':
     main(NaoController)
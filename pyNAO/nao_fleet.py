@@ -0,0 +1,251 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+import collections
+import itertools
+
+from multiprocessing.pool import ThreadPool
+
+from pyNAO.BaseModule           import BaseModule, main, EMSG_ROBOT_NOT_FOUND, INIT_MODES
+from pyNAO.command_dispatcher   import CommandDispatcher
+from pyNAO.metrics              import METRICS
+from pyNAO.nao                  import Nao
+from pyNAO.nao_controller       import parseVector
+
+
+class NaoFleet(BaseModule):
+    """ The NaoFleet class provides a yarp module to control several Nao robots at once.
+
+    A command is dispatched to all robots, or to the robots given by a leading '@<name>,<name>'
+    element. Each robot has its own CommandDispatcher, so the robots execute the command in
+    parallel and the reply is sent as soon as all robots accepted it: 'ack <fleet id>'. The
+    progress of all robots is queried with one 'status <fleet id>' round-trip.
+    """
+
+    # number of fleet commands whose status can be queried
+    HISTORY = CommandDispatcher.HISTORY
+
+
+    def __init__(self, ip, port, prefix):
+        BaseModule.__init__(self, ip, port, prefix)
+        self.robotAddresses = { 'nao': (ip, int(port)) }
+        self.robots         = {}
+        self.dispatchers    = {}
+        self.commands       = collections.OrderedDict()
+        self._ids           = itertools.count(1)
+
+
+    @staticmethod
+    def addArguments(parser):
+        parser.add_argument( '-r', '--robot',
+                             dest       = 'robots',
+                             action     = 'append',
+                             default    = None,
+                             help       = 'Robot <name>=<ip>[:<port>]. Can be given several ' \
+                                          'times. If omitted, --ip and --port are used.' )
+
+
+    def applyArguments(self, args):
+        BaseModule.applyArguments(self, args)
+
+        if not args.robots:
+            return
+
+        self.robotAddresses = {}
+        for spec in args.robots:
+            name, address = spec.split('=', 1)
+            ip, _, port   = address.partition(':')
+            self.robotAddresses[name] = (ip, int(port or BaseModule.TCP_PORT))
+
+
+    def connect(self):
+        """ This method connects to all robots in parallel, since each initialization takes seconds.
+        """
+        self.pool = ThreadPool(len(self.robotAddresses))
+
+        def connectRobot(item):
+            name, (ip, port) = item
+            try:
+                return name, Nao.get(ip, port, INIT_MODES[self.init])
+            except:
+                raise RuntimeError(EMSG_ROBOT_NOT_FOUND % (ip, port))
+
+        robots = dict(self.pool.map(connectRobot, self.robotAddresses.items()))
+        self.pool.close()
+
+        # the dispatchers have to exist before respond sees the robots
+        for name in robots:
+            if name not in self.dispatchers:
+                self.dispatchers[name] = CommandDispatcher()
+        self.robots = robots
+
+
+    def close(self):
+        for dispatcher in self.dispatchers.values():
+            dispatcher.shutdown()
+        return BaseModule.close(self)
+
+
+    def dispatch(self, names, name, func, priority = CommandDispatcher.PRIORITY_NORMAL):
+        """ This method submits \a func to the dispatchers of the robots given by \a names and
+            returns immediately.
+
+        @param names    - list of robot names
+        @param name     - string specifying the command name
+        @param func     - callable taking a Nao object; may return a MotionHandle
+        @param priority - integer; PRIORITY_HIGH preempts the commands of the robots
+                          (default: PRIORITY_NORMAL)
+        @return integer fleet id of the command, see NaoFleet.status
+        """
+        preempt  = priority == CommandDispatcher.PRIORITY_HIGH
+        requests = []
+        for robot in names:
+            call = lambda nao = self.robots[robot]: func(nao)
+            requests.append((robot, self.dispatchers[robot].submit(name, call, priority, preempt)))
+
+        fleetId                = next(self._ids)
+        self.commands[fleetId] = requests
+
+        # forget the oldest commands
+        while len(self.commands) > NaoFleet.HISTORY:
+            self.commands.popitem(last = False)
+
+        return fleetId
+
+
+    def status(self, fleetId):
+        """ This method returns the requests of the robots for the fleet command \a fleetId.
+
+        @param fleetId - integer specifying the fleet id
+        @return list of (robot name, Request) or None if the id is unknown
+        """
+        return self.commands.get(fleetId)
+
+
+    def respond(self, command, reply):
+        """ This is the respond hook method which gets called upon receiving a bottle via RPC port.
+
+        @param command - input bottle
+        @param reply - output bottle
+        @return boolean
+        """
+        if command.get(0).toString() == 'stats':
+            return BaseModule.respond(self, command, reply)
+
+        with METRICS.timer('rpc.respond'):
+            return self._respond(command, reply)
+
+
+    def _respond(self, command, reply):
+        # the RPC port is open while the robots are still being connected
+        if not self.robots:
+            reply.addString('nack')
+            reply.addString('initializing')
+            return True
+
+        if command.get(0).toString() == 'status':
+            return self._respondStatus(command, reply)
+
+        names  = sorted(self.robots.keys())
+        offset = 0
+
+        # optional robot selection
+        if command.get(0).toString().startswith('@'):
+            names  = command.get(0).toString()[1:].split(',')
+            offset = 1
+
+        unknown = [ name for name in names if name not in self.robots ]
+        if unknown:
+            reply.addString('nack')
+            reply.addString('unknown robots: %s' % ', '.join(unknown))
+            return True
+
+        parsed = self.parseCommand(command, offset)
+        if parsed is None:
+            reply.addString('nack')
+            reply.addString('commands: [@<name>,...] look x y z | point <"left"|"right"> x y z | ' \
+                            'posture <name> [<speed>] | stop | status <id> | stats')
+            return True
+
+        action, func = parsed
+        priority     = CommandDispatcher.PRIORITY_HIGH if action == 'stop' else \
+                       CommandDispatcher.PRIORITY_NORMAL
+
+        reply.addString('ack')
+        reply.addInt(self.dispatch(names, action, func, priority))
+        return True
+
+
+    def _respondStatus(self, command, reply):
+        fleetId  = command.get(1).asInt()
+        requests = self.status(fleetId)
+
+        if requests is None:
+            reply.addString('nack')
+            reply.addString('unknown fleet id')
+            return True
+
+        reply.addString('ack')
+        reply.addInt(fleetId)
+        for name, request in requests:
+            entry = reply.addList()
+            entry.addString(name)
+            entry.addString(request.state)
+            entry.addDouble(request.duration * 1000.0)
+        return True
+
+
+    @staticmethod
+    def parseCommand(command, offset):
+        """ This method parses the command of the bottle starting at \a offset.
+
+        @param command - input bottle
+        @param offset  - integer specifying the index of the command name
+        @return (command name, callable taking a Nao object) or None if the command is invalid
+        """
+        action = command.get(offset).toString()
+
+        if action == 'look':
+            vector = parseVector(command, offset + 1)
+            if vector is None:
+                return None
+            return action, lambda nao: nao.look(vector)
+
+        if action == 'point':
+            arm    = command.get(offset + 1).toString()
+            vector = parseVector(command, offset + 2)
+            if arm not in ['left', 'right'] or vector is None:
+                return None
+            return action, lambda nao: nao.point('LArm' if arm == 'left' else 'RArm', vector)
+
+        if action == 'posture':
+            posture = command.get(offset + 1).toString()
+            speed   = command.get(offset + 2).asDouble() if command.size() > offset + 2 else 0.5
+
+            def goToPosture(nao):
+                if not nao.goToPosture(posture, speed):
+                    raise RuntimeError('Could not reach posture %s' % posture)
+            return action, goToPosture
+
+        if action == 'stop':
+            return action, lambda nao: nao.stop()
+
+        return None
+
+
+if __name__ == '__main__':
+    main(NaoFleet)
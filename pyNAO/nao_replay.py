@@ -0,0 +1,281 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+import threading
+import time
+import traceback
+
+import numpy as np
+
+import yarp
+
+from pyNAO.BaseModule         import BaseModule, main, EMSG_YARP_NOT_FOUND
+from pyNAO.metrics            import METRICS
+from pyNAO.nao_video          import ImageBufferRing
+from pyNAO.recording          import RecordingReader, EFFECTORS
+from pyNAO.state_sampler      import RobotState
+
+
+class ReplayStream(object):
+    """ The ReplayStream class publishes the recorded frames of one camera stream on the ports of
+        a NaoVideo CameraStream (<port_base>/img:o and <port_base>/meta:o).
+    """
+
+    def __init__(self, recording, name):
+        """
+        @param recording - RecordingReader
+        @param name      - string specifying the stream name
+        """
+        self.recording  = recording
+        self.name       = name
+        self.frames     = recording.frames(name)
+
+        height, width, channels = recording.shape(name)
+        self.bufRing    = ImageBufferRing(width, height, channels)
+
+
+    def open(self, port_base):
+        """ This method opens the output ports.
+
+        @param port_base - string specifying the prefix of the yarp output ports
+        """
+        self.imgOutPort = yarp.Port()
+        if not self.imgOutPort.open(port_base + '/img:o'):
+            raise RuntimeError(EMSG_YARP_NOT_FOUND)
+
+        self.metaOutPort = yarp.BufferedPortBottle()
+        if not self.metaOutPort.open(port_base + '/meta:o'):
+            raise RuntimeError(EMSG_YARP_NOT_FOUND)
+
+
+    def publish(self, index):
+        """ This method publishes a recorded frame with its original envelope and metadata.
+
+        @param index - integer specifying the position of the frame in the index
+        """
+        record       = self.frames[index]
+        seq          = int(record['seq'])
+        stamp        = yarp.Stamp(seq, float(record['time']))
+
+        image, array = self.bufRing.next()
+        np.copyto(array, self.recording.frame(self.name, record))
+
+        self.imgOutPort.setEnvelope(stamp)
+        self.imgOutPort.write(image)
+        METRICS.count('replay.%s.frames' % self.name)
+
+        if self.metaOutPort.getOutputCount() > 0:
+            bottle = self.metaOutPort.prepare()
+            bottle.clear()
+            bottle.addInt(seq)
+            bottle.addDouble(float(record['time']))
+            bottle.addInt(int(record['camera']))
+            bottle.addInt(array.shape[1])
+            bottle.addInt(array.shape[0])
+            bottle.addDouble(float(record['latency']) * 1000.0)
+            self.metaOutPort.setEnvelope(stamp)
+            self.metaOutPort.write()
+
+
+    def interrupt(self):
+        self.imgOutPort.interrupt()
+        self.metaOutPort.interrupt()
+
+
+    def close(self):
+        self.imgOutPort.close()
+        self.metaOutPort.close()
+
+
+class NaoReplay(BaseModule):
+    """ The NaoReplay class provides a yarp module that republishes a recording of NaoVideo (see
+        --record) on the ports of NaoVideo, so perception can be run without the robot.
+
+    Frames and robot states are published in the order and, scaled by the replay speed, with the
+    timing they were recorded with. The module does not connect to a robot.
+    """
+
+    def __init__(self, ip, port, prefix):
+        BaseModule.__init__(self, ip, port, prefix)
+        self.moduleName = 'NaoVideo'
+        self.recording  = None
+        self.speed      = 1.0
+        self.loop       = False
+        self.streams    = []
+        self.thread     = None
+        self._stopped   = threading.Event()
+
+
+    @staticmethod
+    def addArguments(parser):
+        parser.add_argument( '--recording',
+                             dest       = 'recording',
+                             required   = True,
+                             help       = 'Directory of the recording')
+        parser.add_argument( '--speed',
+                             dest       = 'speed',
+                             default    = 1.0,
+                             type       = float,
+                             help       = 'Replay speed factor; 0 replays as fast as possible ' \
+                                          '(default: 1.0)')
+        parser.add_argument( '--loop',
+                             dest       = 'loop',
+                             action     = 'store_true',
+                             help       = 'Restart the replay at the end of the recording')
+        parser.add_argument( '--replay-as',
+                             dest       = 'replay_as',
+                             default    = 'NaoVideo',
+                             help       = 'Module name used for the port names (default: NaoVideo)')
+
+
+    def applyArguments(self, args):
+        BaseModule.applyArguments(self, args)
+
+        self.recording  = RecordingReader(args.recording)
+        self.speed      = args.speed
+        self.loop       = args.loop
+        self.moduleName = args.replay_as
+
+
+    def connect(self):
+        """ The replay does not need a robot. """
+        pass
+
+
+    def configure(self, rf):
+        BaseModule.configure(self, rf)
+
+        names        = self.recording.streams
+        self.streams = [ ReplayStream(self.recording, name) for name in names ]
+
+        # same port layout as NaoVideo
+        for stream in self.streams:
+            if len(self.streams) == 1:
+                stream.open('/%s' % self.getName())
+            else:
+                stream.open('/%s/%s' % (self.getName(), stream.name))
+
+        if len(self.recording.states()) > 0:
+            self.state_port = yarp.BufferedPortBottle()
+            if not self.state_port.open('/%s/%s' % (self.getName(), 'state:o')):
+                raise RuntimeError, EMSG_YARP_NOT_FOUND
+
+        return True
+
+
+    def schedule(self):
+        """ This method merges the frames of all streams and the robot states by their host time.
+
+        @return host times, sources (stream index or -1 for robot states), indices into the source
+        """
+        times   = [ self.recording.states()['time'] ]
+        sources = [ np.full(len(times[0]), -1, dtype = np.int32) ]
+
+        for source, stream in enumerate(self.streams):
+            times.append(stream.frames['host'])
+            sources.append(np.full(len(stream.frames), source, dtype = np.int32))
+
+        indices = np.concatenate([ np.arange(len(t)) for t in times ])
+        times   = np.concatenate(times)
+        sources = np.concatenate(sources)
+
+        order   = np.argsort(times, kind = 'mergesort')
+        return times[order], sources[order], indices[order]
+
+
+    def replay(self):
+        """ This method publishes the recording until it ends or the module is stopped. """
+        times, sources, indices = self.schedule()
+        states                  = self.recording.states()
+
+        while len(times) > 0:
+            start = time.time()
+
+            for offset, source, index in zip(times - times[0], sources, indices):
+                if self.speed > 0:
+                    delay = offset / self.speed - (time.time() - start)
+                    if delay > 0 and self._stopped.wait(delay):
+                        return
+
+                if self._stopped.is_set():
+                    return
+
+                try:
+                    if source < 0:
+                        self.publishState(self.createState(states[index]))
+                    else:
+                        self.streams[source].publish(index)
+                except Exception:
+                    traceback.print_exc()
+
+            if not self.loop:
+                return
+
+
+    def createState(self, record):
+        """ This method converts a recorded robot state for BaseModule.publishState.
+
+        @param record - stateDtype record
+        @return RobotState
+        """
+        positions = dict( (effector, record['positions'][i].tolist())
+                          for i, effector in enumerate(EFFECTORS) )
+        return RobotState(float(record['time']), self.recording.joints, 
+                          record['angles'].tolist(), record['stiffnesses'].tolist(), positions)
+
+
+    def runModule(self, rf = None):
+        self.thread        = threading.Thread(target = self.replay, name = 'NaoReplay')
+        self.thread.daemon = True
+        self.thread.start()
+
+        # the yarp module loop takes care of getPeriod, updateModule and interruptModule
+        result = yarp.RFModule.runModule(self)
+        self.close()
+        return result
+
+
+    def updateModule(self):
+        # stop the module at the end of the recording
+        if not self.thread.is_alive():
+            return False
+        return BaseModule.updateModule(self)
+
+
+    def interruptModule(self):
+        self._stopped.set()
+        for stream in self.streams:
+            stream.interrupt()
+        return BaseModule.interruptModule(self)
+
+
+    def close(self):
+        self._stopped.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join(1.0)
+
+        for stream in self.streams:
+            stream.close()
+        self.streams = []
+        return BaseModule.close(self)
+
+
+if __name__ == '__main__':
+    try:
+        main(NaoReplay)
+    except Exception as e:
+        print e
@@ -15,6 +15,9 @@
 #    You should have received a copy of the GNU Affero General Public License                      #
 #    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
 ####################################################################################################
+import base64
+import functools
+import threading
 import time
 import sys
 
@@ -22,42 +25,471 @@ import numpy as np
 
 import yarp
 
-from pyNAO.BaseModule         import BaseModule, main
+from pyNAO.BaseModule         import BaseModule, main, EMSG_YARP_NOT_FOUND
+from pyNAO.nao                import Nao
+from pyNAO.frame_grabber      import LatestFrameSlot, FrameGrabber, FramePublisher
+from pyNAO.frame_codec        import FrameEncoder, FORMATS
+from pyNAO.frame_pipeline     import FramePipeline
+from pyNAO.metrics            import METRICS
+from pyNAO.recording          import RecordingWriter
 from PIL                      import Image
 
+def yuv422ToRgb(data, width, height, out):
+    """ This method converts a YUV422 (YUYV) image into RGB using vectorized numpy operations.
+
+    @param data   - string/buffer containing the YUV422 pixel data
+    @param width  - integer specifying the width of the image
+    @param height - integer specifying the height of the image
+    @param out    - uint8 array of shape (height, width, 3) receiving the RGB image
+    @return out
+    """
+    yuyv = np.frombuffer(data, dtype = np.uint8).reshape(height, width // 2, 4).astype(np.float32)
+
+    # each 4 byte group (Y0 U Y1 V) encodes two pixels sharing U and V
+    y    = yuyv[:, :, 0::2]
+    u    = yuyv[:, :, 1:2] - 128.0
+    v    = yuyv[:, :, 3:4] - 128.0
+
+    rgb  = out.reshape(height, width // 2, 2, 3)
+    rgb[:, :, :, 0] = np.clip(y + 1.402 * v,                 0, 255)
+    rgb[:, :, :, 1] = np.clip(y - 0.344136 * u - 0.714136 * v, 0, 255)
+    rgb[:, :, :, 2] = np.clip(y + 1.772 * u,                 0, 255)
+    return out
+
+
+class ImageBufferRing(object):
+    """ The ImageBufferRing class holds a fixed number of preallocated yarp image buffers that are
+        reused round-robin, so that a frame never needs a fresh allocation.
+    """
+
+    def __init__(self, width = 320, height = 240, channels = 3, size = 3, colorspace = 'rgb'):
+        self.width      = width
+        self.height     = height
+        self.channels   = channels
+        self.colorspace = colorspace
+        self._buffers   = [ NaoVideo.createImageBuffer(width, height, channels)
+                            for _ in range(size) ]
+        self._index     = 0
+
+
+    def next(self):
+        """ This method returns the next image buffer of the ring.
+
+        @return image, buffer array
+        """
+        buf          = self._buffers[self._index]
+        self._index  = (self._index + 1) % len(self._buffers)
+        return buf
+
+
+    def fill(self, data):
+        """ This method copies the raw pixel \a data into the next buffer of the ring. The data is
+            wrapped by a numpy view, so the copy into the yarp image is the only copy per frame.
+            YUV422 data is converted to RGB on the way.
+
+        @param data - string/buffer containing the raw pixel data
+        @return yarp image, buffer array
+        """
+        image, array = self.next()
+
+        if self.colorspace == 'yuv422':
+            yuv422ToRgb(data, self.width, self.height, array)
+        else:
+            np.copyto(array, np.frombuffer(data, dtype = np.uint8).reshape(array.shape))
+        return image, array
+
+
+class CameraStream(object):
+    """ The CameraStream class streams the images of one camera subscription to a yarp port.
+
+    A grabber thread fetches the camera images at the target frame rate and a publisher thread
+    writes the latest one to the output port. Frames that the publisher could not keep up with are
+    dropped, so a slow reader does not delay the camera fetch.
+    """
+
+    def __init__(self, camera = 'bottom', resolution = 'qvga', colorspace = 'rgb', fps = 30, 
+                 name = None):
+        """
+        @param camera     - string specifying the camera, 'top' or 'bottom'  (default: 'bottom')
+        @param resolution - string specifying a key of Nao.RESOLUTIONS       (default: 'qvga')
+        @param colorspace - string specifying a key of Nao.COLORSPACES       (default: 'rgb')
+        @param fps        - integer specifying the target frame rate         (default: 30)
+        @param name       - string specifying the stream name                (default: camera)
+        """
+        if camera not in Nao.CAMERAS:
+            raise ValueError('Unknown camera: %s' % camera)
+        if resolution not in Nao.RESOLUTIONS:
+            raise ValueError('Unknown resolution: %s' % resolution)
+        if colorspace not in Nao.COLORSPACES:
+            raise ValueError('Unknown colorspace: %s' % colorspace)
+
+        self.camera     = camera
+        self.resolution = resolution
+        self.colorspace = colorspace
+        self.fps        = int(fps)
+        self.name       = name or camera
+        self.client     = None
+        self.encoder    = None
+        self.recorder   = None
+        self.pipeline   = None
+        self.latency    = None
+
+
+    @staticmethod
+    def parse(spec):
+        """ This method creates a stream from a string of the form 
+            '[<name>=]<camera>[:<resolution>[:<colorspace>[:<fps>]]]', e.g. 'top:vga:yuv422:15'.
+
+        @param spec - string specifying the stream
+        @return CameraStream
+        """
+        name = None
+        if '=' in spec:
+            name, spec = spec.split('=', 1)
+
+        return CameraStream(*spec.split(':'), name = name)
+
+
+    @property
+    def size(self):
+        return Nao.RESOLUTIONS[self.resolution][1:]
+
+
+    def open(self, nao, port_base, subscriber, encoder = None, pipeline = None):
+        """ This method subscribes the camera and opens the output ports <port_base>/img:o,
+            <port_base>/meta:o, if an \a encoder is given, <port_base>/<encoding>:o and, if a
+            \a pipeline is given, <port_base>/<stage>:o for each stage.
+
+        @param nao        - Nao object
+        @param port_base  - string specifying the prefix of the yarp output ports
+        @param subscriber - string specifying the ALVideoDevice subscriber name
+        @param encoder    - FrameEncoder for the encoded output port (default: None)
+        @param pipeline   - FramePipeline processing the frames (default: None)
+        """
+        width, height   = self.size
+        self.bufRing    = ImageBufferRing(width, height, colorspace = self.colorspace)
+        self.imgOutPort = yarp.Port()
+
+        if not self.imgOutPort.open(port_base + '/img:o'):
+            raise RuntimeError(EMSG_YARP_NOT_FOUND)
+
+        self.metaOutPort = yarp.BufferedPortBottle()
+        if not self.metaOutPort.open(port_base + '/meta:o'):
+            raise RuntimeError(EMSG_YARP_NOT_FOUND)
+
+        self.encoder    = encoder
+        if encoder is not None:
+            self._encSeq     = 0
+            self._encLock    = threading.Lock()
+            self.encOutPort  = yarp.Port()
+            if not self.encOutPort.open('%s/%s:o' % (port_base, encoder.encoding)):
+                raise RuntimeError(EMSG_YARP_NOT_FOUND)
+
+        self.pipeline   = pipeline
+        if pipeline is not None:
+            pipeline.open(port_base)
+
+        self.nao        = nao
+        self.client     = nao.startVision(self.camera, self.resolution, self.colorspace, self.fps, 
+                                          subscriber)
+
+        self.frameSlot  = LatestFrameSlot()
+        self.grabber    = FrameGrabber( self.fetch, self.frameSlot, self.fps,
+                                        'FrameGrabber-%s' % self.name, 'video.%s' % self.name )
+        self.publisher  = FramePublisher( self.publish, self.frameSlot, 
+                                          'FramePublisher-%s' % self.name, 'video.%s' % self.name )
+
+
+    def start(self):
+        self.grabber.start()
+        self.publisher.start()
+
+
+    def isAlive(self):
+        return self.grabber.is_alive() and self.publisher.is_alive()
+
+
+    def fetch(self):
+        """ This method fetches the latest camera image.
+
+        @return (host time the fetch started, image as returned by ALVideoDevice.getImageRemote) or
+                None
+        """
+        # taken before the call, so the latency includes the image transfer
+        started = time.time()
+        frame   = self.nao.getImage(self.client)
+        return None if frame is None else (started, frame)
+
+
+    def publish(self, seq, item):
+        """ This method publishes a camera image on the output port. The yarp envelope carries the
+            sequence number and the capture time of the robot, so readers can detect dropped frames
+            and synchronize the frames with the joint states. The meta port additionally provides
+            (<seq> <capture time> <camera id> <width> <height> <fetch to publish latency in ms>),
+            measured from the start of the image request, so it includes the image transfer.
+
+        @param seq  - integer specifying the sequence number of the frame
+        @param item - (host time the fetch started, image as returned by
+                      ALVideoDevice.getImageRemote)
+        """
+        fetched, frame = item
+
+        # capture time of the robot (index 4 and 5) and camera id (index 7)
+        timestamp    = frame[4] + frame[5] * 1e-6
+        camera       = frame[7] if len(frame) > 7 else Nao.CAMERAS[self.camera]
+        stamp        = yarp.Stamp(seq, timestamp)
+
+        # wrap the image data (index 6) and copy it into the next preallocated yarp image
+        image, array = self.bufRing.fill(frame[6])
+
+        # encode only if someone is reading; the copy keeps the ring buffer reusable
+        if self.encoder is not None and self.encOutPort.getOutputCount() > 0:
+            callback = functools.partial(self.publishEncoded, timestamp = timestamp, 
+                                         camera = camera)
+            self.encoder.submit(seq, array.copy(), callback)
+
+        # Send the result to the output port
+        self.imgOutPort.setEnvelope(stamp)
+        self.imgOutPort.write(image)
+
+        self.latency = time.time() - fetched
+        METRICS.observe('video.%s.latency' % self.name, self.latency)
+
+        # the processing stages run after the raw frame is out, only for connected readers
+        if self.pipeline is not None:
+            self.pipeline.process(array, stamp)
+
+        if self.recorder is not None:
+            self.recorder.append(seq, timestamp, camera, fetched, self.latency, array)
+
+        if self.metaOutPort.getOutputCount() > 0:
+            bottle = self.metaOutPort.prepare()
+            bottle.clear()
+            bottle.addInt(seq)
+            bottle.addDouble(timestamp)
+            bottle.addInt(camera)
+            bottle.addInt(array.shape[1])
+            bottle.addInt(array.shape[0])
+            bottle.addDouble(self.latency * 1000.0)
+            self.metaOutPort.setEnvelope(stamp)
+            self.metaOutPort.write()
+
+
+    def publishEncoded(self, seq, array, data, timestamp = 0.0, camera = -1):
+        """ This method publishes an encoded image as bottle 
+            (<encoding> <width> <height> <seq> <base64 data> <capture time> <camera id>). Frames
+            that finished encoding after a newer frame are dropped.
+
+        @param seq       - integer specifying the sequence number of the frame
+        @param array     - image array that was encoded
+        @param data      - string containing the encoded image
+        @param timestamp - float specifying the capture time of the robot (default: 0.0)
+        @param camera    - integer specifying the camera id (default: -1)
+        """
+        with self._encLock:
+            if seq <= self._encSeq:
+                return
+            self._encSeq = seq
+
+            bottle = yarp.Bottle()
+            bottle.addString(self.encoder.encoding)
+            bottle.addInt(array.shape[1])
+            bottle.addInt(array.shape[0])
+            bottle.addInt(seq)
+            bottle.addString(base64.b64encode(data))
+            bottle.addDouble(timestamp)
+            bottle.addInt(camera)
+            self.encOutPort.setEnvelope(yarp.Stamp(seq, timestamp))
+            self.encOutPort.write(bottle)
+
+
+    def interrupt(self):
+        self.grabber.stop()
+        self.publisher.stop()
+        self.imgOutPort.interrupt()
+        self.metaOutPort.interrupt()
+        if self.encoder is not None:
+            self.encOutPort.interrupt()
+        if self.pipeline is not None:
+            self.pipeline.interrupt()
+
+
+    def close(self, nao):
+        self.grabber.stop()
+        self.publisher.stop()
+        for thread in (self.grabber, self.publisher):
+            if thread.is_alive():
+                thread.join(1.0)
+
+        if self.client is not None:
+            nao.stopVision(self.client)
+            self.client = None
+        self.imgOutPort.close()
+        self.metaOutPort.close()
+        if self.encoder is not None:
+            self.encOutPort.close()
+        if self.pipeline is not None:
+            self.pipeline.close()
+
+
 class NaoVideo(BaseModule):
-    """ The NaoVideo class provides a yarp module to retrieve the Nao's video stream. """
+    """ The NaoVideo class provides a yarp module to retrieve the Nao's video streams.
+
+    Each camera stream is published on its own port. A single stream uses /<name>/img:o, several
+    streams use /<name>/<stream name>/img:o.
+    """
+
+    # Streams used if none are given on the command line
+    STREAMS = [ 'bottom:qvga:rgb:30' ]
+
+
+    def __init__(self, ip, port, prefix):
+        BaseModule.__init__(self, ip, port, prefix)
+        self.streams   = [ CameraStream.parse(spec) for spec in NaoVideo.STREAMS ]
+        self.encoder   = None
+        self.record    = None
+        self.chunkSize = 256
+        self.pipeline  = None
+        self.recording = None
+
+
+    @staticmethod
+    def addArguments(parser):
+        parser.add_argument( '-s', '--stream',
+                             dest       = 'streams',
+                             action     = 'append',
+                             default    = None,
+                             help       = 'Camera stream [<name>=]<camera>[:<resolution>' \
+                                          '[:<colorspace>[:<fps>]]], e.g. top:vga:yuv422:15. ' \
+                                          'Can be given several times.' )
+        parser.add_argument( '-e', '--encoding',
+                             dest       = 'encoding',
+                             default    = None,
+                             choices    = sorted(FORMATS.keys()),
+                             help       = 'Additionally publish encoded frames on ' \
+                                          '<port>/<encoding>:o')
+        parser.add_argument( '--quality',
+                             dest       = 'quality',
+                             default    = 80,
+                             type       = int,
+                             help       = 'JPEG quality [1, 95]')
+        parser.add_argument( '--level',
+                             dest       = 'level',
+                             default    = 6,
+                             type       = int,
+                             help       = 'PNG compression level [0, 9]')
+        parser.add_argument( '--workers',
+                             dest       = 'workers',
+                             default    = 2,
+                             type       = int,
+                             help       = 'Number of encoder threads')
+        parser.add_argument( '--pipeline',
+                             dest       = 'pipeline',
+                             default    = None,
+                             help       = 'Processing stages <stage>[=<arg>[:<arg>]],... of ' \
+                                          'downscale=<factor>, crop=<x>:<y>:<w>:<h>, gray and ' \
+                                          'diff=<threshold>; each publishes on <port>/<stage>:o')
+        parser.add_argument( '--record',
+                             dest       = 'record',
+                             default    = None,
+                             help       = 'Record the frames and the robot states to this ' \
+                                          'directory (replay with NaoReplay)')
+        parser.add_argument( '--chunk-size',
+                             dest       = 'chunk_size',
+                             default    = 256,
+                             type       = int,
+                             help       = 'Number of frames per recording chunk file')
+
+
+    def applyArguments(self, args):
+        BaseModule.applyArguments(self, args)
+
+        if args.streams:
+            self.streams = [ CameraStream.parse(spec) for spec in args.streams ]
+
+        if args.encoding:
+            self.encoder = FrameEncoder(args.encoding, args.quality, args.level, args.workers)
+
+        self.record    = args.record
+        self.pipeline  = args.pipeline
+
+        # fail early on an invalid pipeline
+        if self.pipeline:
+            FramePipeline.parse(self.pipeline)
+        self.chunkSize = args.chunk_size
+
 
-    
     def configure(self, rf):
         BaseModule.configure(self, rf)
 
-        self.bufImageOut, self.bufArrayOut = self.createImageBuffer(320, 240)
-        self.imgOutPort = yarp.Port()
-        self.imgOutPort.open('/NaoVideo/img:o')
+        names = [ stream.name for stream in self.streams ]
+        if len(set(names)) != len(names):
+            raise ValueError('Stream names need to be unique: %s' % ', '.join(names))
+
+        for stream in self.streams:
+            if len(self.streams) == 1:
+                port_base = '/%s' % self.getName()
+            else:
+                port_base = '/%s/%s' % (self.getName(), stream.name)
+
+            subscriber = '%s_%s' % (self.getName().replace('/', '_'), stream.name)
+            pipeline   = None
+            if self.pipeline:
+                width, height = stream.size
+                pipeline      = FramePipeline.parse(self.pipeline, 'video.%s' % stream.name)
+                pipeline.check((height, width, 3))
+
+            stream.open(self.nao, port_base, subscriber, self.encoder, pipeline)
+
+        if self.record:
+            self.recording = RecordingWriter(self.record, self.chunkSize)
+            for stream in self.streams:
+                width, height   = stream.size
+                stream.recorder = self.recording.addStream(stream.name, width, height)
+
+            # the robot states are recorded at the state rate, or at 20 Hz if it is not set
+            self.sampler = self.nao.startStateSampler(self.stateRate or 20.0)
+            self.sampler.listeners.append(self.recording.addState)
 
-        self.nao.startVision()
         return True
     
 
     def runModule(self, rf = None):
+        for stream in self.streams:
+            stream.start()
 
-        while True:
-            # convert the string array
-            self.bufArrayOut[:,:] = np.fromstring(self.nao.getImage()[6], dtype=np.uint8).reshape(240,320,3)
-          
-            # Send the result to the output port
-            self.imgOutPort.write(self.bufImageOut)
+        # the yarp module loop takes care of getPeriod, updateModule and interruptModule
+        result = yarp.RFModule.runModule(self)
+        self.close()
+        return result
+
+
+    def updateModule(self):
+        # stop the module if one of the worker threads died
+        if not all(stream.isAlive() for stream in self.streams):
+            return False
+        return BaseModule.updateModule(self)
 
 
     def interruptModule(self):
-        self.imgOutPort.interrupt()
+        for stream in self.streams:
+            stream.interrupt()
         return BaseModule.interruptModule(self)
 
 
     def close(self):
-        self.nao.stopVision()
-        self.imgOutPort.close()
+        for stream in self.streams:
+            stream.close(self.nao)
+
+        if self.encoder is not None:
+            self.encoder.close()
+            self.encoder = None
+
+        if self.recording is not None:
+            if self.recording.addState in self.sampler.listeners:
+                self.sampler.listeners.remove(self.recording.addState)
+            self.recording.close()
+            self.recording = None
         return BaseModule.close(self)
 
     
@@ -0,0 +1,124 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+import threading
+import time
+
+from pyNAO.backend import ALProxy
+from pyNAO.metrics import METRICS, InstrumentedProxy
+
+
+class ProxyPool(object):
+    """ The ProxyPool class shares one ALProxy per (ip, port, service) within the process and
+        reconnects proxies that fail their health check.
+    """
+
+    # minimum time between two health checks of all proxies in seconds
+    CHECK_INTERVAL = 5.0
+
+
+    def __init__(self, factory = ALProxy):
+        """
+        @param factory - callable creating a proxy from (service, ip, port) (default: ALProxy)
+        """
+        self.factory    = factory
+        self._proxies   = {}
+        self._lock      = threading.RLock()
+        self._lastCheck = 0.0
+
+
+    def get(self, ip, port, service):
+        """ This method returns the shared proxy to \a service and creates it if necessary.
+
+        @param ip      - string specifying the IP address of the robot
+        @param port    - integer specifying the port of the robot
+        @param service - string specifying the NAOqi service, e.g. 'ALMotion'
+        @return proxy
+        """
+        key = (ip, int(port), service)
+
+        with self._lock:
+            proxy = self._proxies.get(key)
+            if proxy is None:
+                proxy = self.factory(service, ip, int(port))
+                if METRICS.enabled:
+                    proxy = InstrumentedProxy(proxy, service, METRICS)
+                self._proxies[key] = proxy
+            return proxy
+
+
+    def check(self, ip, port, service):
+        """ This method checks the proxy to \a service and reconnects it if it does not respond.
+
+        @param ip      - string specifying the IP address of the robot
+        @param port    - integer specifying the port of the robot
+        @param service - string specifying the NAOqi service
+        @return True if the proxy is healthy (after a reconnect)
+        """
+        key = (ip, int(port), service)
+
+        with self._lock:
+            proxy = self._proxies.get(key)
+
+        try:
+            if proxy is not None and proxy.ping():
+                return True
+        except Exception:
+            pass
+
+        self.invalidate(ip, port, service)
+        try:
+            self.get(ip, port, service)
+            return True
+        except Exception:
+            return False
+
+
+    def checkAll(self, force = False):
+        """ This method checks all proxies, at most once every ProxyPool.CHECK_INTERVAL seconds.
+
+        @param force - boolean; if True the check interval is ignored (default: False)
+        @return dictionary (ip, port, service) -> health state of the checked proxies
+        """
+        with self._lock:
+            now = time.time()
+            if not force and now - self._lastCheck < ProxyPool.CHECK_INTERVAL:
+                return {}
+            self._lastCheck = now
+            keys            = list(self._proxies.keys())
+
+        return dict( (key, self.check(*key)) for key in keys )
+
+
+    def invalidate(self, ip, port, service):
+        with self._lock:
+            self._proxies.pop((ip, int(port), service), None)
+
+
+# process-wide pool
+POOL = ProxyPool()
+
+
+def getProxy(ip, port, service):
+    """ This method returns the shared proxy to \a service from the process-wide pool.
+
+    @param ip      - string specifying the IP address of the robot
+    @param port    - integer specifying the port of the robot
+    @param service - string specifying the NAOqi service, e.g. 'ALMotion'
+    @return proxy
+    """
+    return POOL.get(ip, port, service)
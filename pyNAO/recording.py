@@ -0,0 +1,339 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+import bisect
+import collections
+import json
+import os
+import threading
+
+import numpy as np
+
+
+# index record of a recorded frame; the head angles are NaN if no robot state was known
+FRAME_DTYPE = np.dtype([ ('seq',     '<i8'),
+                         ('time',    '<f8'),
+                         ('host',    '<f8'),
+                         ('latency', '<f4'),
+                         ('camera',  '<i4'),
+                         ('chunk',   '<i4'),
+                         ('slot',    '<i4'),
+                         ('head',    '<f4', (2,)) ])
+
+# head joints stored with each frame
+HEAD_JOINTS = ['HeadYaw', 'HeadPitch']
+
+# effectors stored with each robot state, see StateSampler.Effectors
+EFFECTORS   = ['Head', 'LArm', 'RArm']
+
+
+def stateDtype(joints):
+    """ This method returns the index record of a recorded robot state.
+
+    @param joints - integer specifying the number of joints
+    @return numpy dtype
+    """
+    return np.dtype([ ('time',        '<f8'),
+                      ('angles',      '<f4', (joints,)),
+                      ('stiffnesses', '<f4', (joints,)),
+                      ('positions',   '<f4', (len(EFFECTORS), 6)) ])
+
+
+def loadIndex(filename, dtype):
+    """ This method maps an index file into memory. A record that was only partially written, e.g.
+        because the recording got killed, is ignored.
+
+    @param filename - string specifying the index file
+    @param dtype    - numpy dtype of the records
+    @return read-only record array
+    """
+    count = os.path.getsize(filename) // dtype.itemsize if os.path.exists(filename) else 0
+    if count == 0:
+        return np.zeros(0, dtype)
+    return np.memmap(filename, dtype, mode = 'r', shape = (count,))
+
+
+class StreamWriter(object):
+    """ The StreamWriter class appends the frames of one camera stream to a recording. The frames
+        are copied into memory mapped chunk files and an index record is appended per frame, so
+        memory use does not grow with the length of the recording.
+    """
+
+    def __init__(self, recording, name, width, height, channels):
+        self.recording  = recording
+        self.name       = name
+        self.shape      = (height, width, channels)
+        self.count      = 0
+        self._chunk     = None
+        self._index     = open(recording.path(name + '.index'), 'ab')
+
+
+    def append(self, seq, timestamp, camera, host, latency, array):
+        """ This method appends a frame.
+
+        @param seq       - integer specifying the sequence number of the frame
+        @param timestamp - float specifying the capture time of the robot
+        @param camera    - integer specifying the camera id
+        @param host      - float specifying the host time the frame was fetched
+        @param latency   - float specifying the fetch to publish latency in seconds
+        @param array     - uint8 array of the frame
+        """
+        chunk, slot = divmod(self.count, self.recording.chunkSize)
+        if slot == 0:
+            self._openChunk(chunk)
+        self._chunk[slot] = array
+
+        record            = np.zeros(1, FRAME_DTYPE)
+        record['seq']     = seq
+        record['time']    = timestamp
+        record['host']    = host
+        record['latency'] = latency
+        record['camera']  = camera
+        record['chunk']   = chunk
+        record['slot']    = slot
+        record['head']    = self.recording.headAngles(host)
+
+        # the index is written last, so every indexed frame is complete
+        self._index.write(record.tostring())
+        self._index.flush()
+        self.count       += 1
+
+
+    def close(self):
+        if self._chunk is not None:
+            self._chunk.flush()
+            self._chunk = None
+        self._index.close()
+
+
+    def _openChunk(self, chunk):
+        if self._chunk is not None:
+            self._chunk.flush()
+
+        filename    = self.recording.path('%s.%06d.npy' % (self.name, chunk))
+        self._chunk = np.lib.format.open_memmap(filename, 'w+', np.uint8,
+                                                (self.recording.chunkSize,) + self.shape)
+
+
+class RecordingWriter(object):
+    """ The RecordingWriter class records camera streams and robot states to a directory:
+
+        meta.json               - streams, joint names and chunk size
+        <stream>.index          - one FRAME_DTYPE record per frame
+        <stream>.<chunk>.npy    - chunks of frames of shape (chunkSize, height, width, channels)
+        state.index             - one stateDtype record per robot state
+
+    All files are append-only and can be memory mapped while the recording is running.
+    """
+
+    # number of recent robot states kept to look up the head angles of a frame
+    HISTORY = 100
+
+    def __init__(self, directory, chunkSize = 256):
+        """
+        @param directory - string specifying the recording directory; it gets created if needed
+        @param chunkSize - integer specifying the number of frames per chunk file (default: 256)
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if os.path.exists(os.path.join(directory, 'meta.json')):
+            raise ValueError('Recording already exists: %s' % directory)
+
+        self.directory  = directory
+        self.chunkSize  = int(chunkSize)
+        self.streams    = {}
+        self.joints     = None
+        self._states    = collections.deque(maxlen = RecordingWriter.HISTORY)
+        self._stateFile = None
+        self._stateType = None
+        self._lock      = threading.Lock()
+        self._writeMeta()
+
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+
+    def addStream(self, name, width, height, channels = 3):
+        """ This method adds a camera stream to the recording.
+
+        @param name     - string specifying the stream name
+        @param width    - integer specifying the width of the frames
+        @param height   - integer specifying the height of the frames
+        @param channels - integer specifying the number of color channels (default: 3)
+        @return StreamWriter
+        """
+        with self._lock:
+            if name in self.streams:
+                raise ValueError('Stream already recorded: %s' % name)
+
+            self.streams[name] = StreamWriter(self, name, width, height, channels)
+            self._writeMeta()
+            return self.streams[name]
+
+
+    def addState(self, state):
+        """ This method appends a robot state. It can be used as StateSampler listener.
+
+        @param state - RobotState
+        """
+        with self._lock:
+            if self._stateFile is None:
+                self.joints     = list(state.joints)
+                self._stateType = stateDtype(len(self.joints))
+                self._stateFile = open(self.path('state.index'), 'ab')
+                self._writeMeta()
+
+            record                = np.zeros(1, self._stateType)
+            record['time']        = state.timestamp
+            record['angles']      = state.angles
+            record['stiffnesses'] = state.stiffnesses
+            record['positions']   = [ state.positions.get(effector, [np.nan] * 6)
+                                      for effector in EFFECTORS ]
+
+            self._stateFile.write(record.tostring())
+            self._stateFile.flush()
+            self._states.append(state)
+
+
+    def headAngles(self, timestamp):
+        """ This method returns the head angles of the recent robot state that was sampled closest
+            to \a timestamp.
+
+        @param timestamp - float specifying the host time, e.g. the fetch time of a frame
+        @return [HeadYaw, HeadPitch], NaN if there is no state
+        """
+        with self._lock:
+            states = list(self._states)
+        if not states:
+            return [np.nan] * len(HEAD_JOINTS)
+
+        index = bisect.bisect_left([ state.timestamp for state in states ], timestamp)
+        state = min(states[max(index - 1, 0):index + 1],
+                    key = lambda state: abs(state.timestamp - timestamp))
+        return [ state.getAngle(joint) for joint in HEAD_JOINTS ]
+
+
+    def close(self):
+        with self._lock:
+            for stream in self.streams.values():
+                stream.close()
+            if self._stateFile is not None:
+                self._stateFile.close()
+                self._stateFile = None
+
+
+    def _writeMeta(self):
+        meta = { 'chunkSize': self.chunkSize,
+                 'joints':    self.joints,
+                 'effectors': EFFECTORS,
+                 'streams':   dict( (name, { 'shape': list(stream.shape) })
+                                    for name, stream in self.streams.items() ) }
+
+        # replace the file atomically, so a reader never sees a partial file
+        filename = self.path('meta.json')
+        with open(filename + '.tmp', 'w') as output:
+            json.dump(meta, output, indent = 2, sort_keys = True)
+        os.rename(filename + '.tmp', filename)
+
+
+class RecordingReader(object):
+    """ The RecordingReader class provides memory mapped access to a recording written by a
+        RecordingWriter. Frames are only read from disk when they are accessed.
+    """
+
+    # chunk files kept mapped per stream; the current and the previous one suffice for playback
+    CHUNKS = 2
+
+    def __init__(self, directory):
+        """
+        @param directory - string specifying the recording directory
+        """
+        with open(os.path.join(directory, 'meta.json')) as meta:
+            self.meta  = json.load(meta)
+
+        self.directory = directory
+        self.chunkSize = self.meta['chunkSize']
+        self.joints    = self.meta['joints']
+        self._chunks   = collections.OrderedDict()
+
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+
+    @property
+    def streams(self):
+        return sorted(self.meta['streams'])
+
+
+    def shape(self, stream):
+        """ @return (height, width, channels) of the frames of \a stream """
+        return tuple(self.meta['streams'][stream]['shape'])
+
+
+    def frames(self, stream):
+        """ This method returns the frame index of \a stream.
+
+        @param stream - string specifying the stream name
+        @return FRAME_DTYPE record array
+        """
+        return loadIndex(self.path(stream + '.index'), FRAME_DTYPE)
+
+
+    def frame(self, stream, record):
+        """ This method returns the image of a frame.
+
+        Only the RecordingReader.CHUNKS most recently used chunk files of a stream stay mapped.
+        The mapping of an evicted chunk is closed as soon as no returned frame of it is referenced
+        anymore, so frames that are kept should be copied.
+
+        @param stream - string specifying the stream name
+        @param record - FRAME_DTYPE record of the frame
+        @return read-only uint8 array of shape (height, width, channels)
+        """
+        key   = (stream, int(record['chunk']))
+        chunk = self._chunks.pop(key, None)
+
+        if chunk is None:
+            chunk  = np.load(self.path('%s.%06d.npy' % key), mmap_mode = 'r')
+            mapped = [ other for other in self._chunks if other[0] == stream ]
+            for other in mapped[:len(mapped) - RecordingReader.CHUNKS + 1]:
+                del self._chunks[other]
+
+        # the most recently used chunk goes last
+        self._chunks[key] = chunk
+        return chunk[int(record['slot'])]
+
+
+    def states(self):
+        """ @return stateDtype record array of the robot states (empty if none were recorded) """
+        if not self.joints:
+            return np.zeros(0, stateDtype(0))
+        return loadIndex(self.path('state.index'), stateDtype(len(self.joints)))
+
+
+    def stateAt(self, timestamp):
+        """ This method returns the latest robot state recorded at or before \a timestamp (host
+            time), e.g. the frame record's 'host' field.
+
+        @param timestamp - float specifying the host time
+        @return stateDtype record or None
+        """
+        states = self.states()
+        index  = np.searchsorted(states['time'], timestamp, side = 'right') - 1
+        return states[index] if index >= 0 else None
@@ -0,0 +1,148 @@
+####################################################################################################
+#    Copyright (C) 2016 by Ingo Keller                                                             #
+#    <brutusthetschiepel@gmail.com>                                                                #
+#                                                                                                  #
+#    This file is part of pyNao (Python/Yarp Tools for the NAO robot).                             #
+#                                                                                                  #
+#    pyNao is free software: you can redistribute it and/or modify it under the terms of the       #
+#    GNU Affero General Public License as published by the Free Software Foundation, either        #
+#    version 3 of the License, or (at your option) any later version.                              #
+#                                                                                                  #
+#    pyNao is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;            #
+#    without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.     #
+#    See the GNU Affero General Public License for more details.                                   #
+#                                                                                                  #
+#    You should have received a copy of the GNU Affero General Public License                      #
+#    along with pyNao.  If not, see <http://www.gnu.org/licenses/>.                                #
+####################################################################################################
+import collections
+import threading
+import time
+import traceback
+
+
+class RobotState(object):
+    """ The RobotState class is a timestamped snapshot of joint angles, stiffnesses and effector
+        positions.
+    """
+
+    def __init__(self, timestamp, joints, angles, stiffnesses, positions):
+        self.timestamp   = timestamp
+        self.joints      = joints
+        self.angles      = angles
+        self.stiffnesses = stiffnesses
+        self.positions   = positions
+
+
+    @property
+    def age(self):
+        return time.time() - self.timestamp
+
+
+    def getAngle(self, joint):
+        return self.angles[self.joints.index(joint)]
+
+
+class StateSampler(threading.Thread):
+    """ The StateSampler thread polls the robot state at a fixed rate and keeps the latest states in
+        a ring buffer, so that readers do not need a round-trip to the robot.
+    """
+
+    Effectors    = ['Head', 'LArm', 'RArm']
+
+    # ALMemory keys of the joint angles (sensor or command value) and stiffnesses
+    AngleKeys    = { True:  'Device/SubDeviceList/%s/Position/Sensor/Value',
+                     False: 'Device/SubDeviceList/%s/Position/Actuator/Value' }
+    StiffnessKey = 'Device/SubDeviceList/%s/Hardness/Actuator/Value'
+
+
+    def __init__(self, nao, rate = 20.0, history = 100, useSensors = True):
+        """
+        @param nao        - Nao object
+        @param rate       - float specifying the sampling rate in Hz      (default: 20.0)
+        @param history    - integer specifying the ring buffer size       (default: 100)
+        @param useSensors - boolean; read sensor instead of command values (default: True)
+        """
+        threading.Thread.__init__(self, name = 'StateSampler')
+        self.daemon      = True
+        self.nao         = nao
+        self.period      = 1.0 / rate
+        self.useSensors  = useSensors
+        self.listeners   = []
+        self._states     = collections.deque(maxlen = history)
+        self._stopped    = threading.Event()
+        self._joints     = None
+        self._keys       = None
+
+
+    def stop(self):
+        self._stopped.set()
+
+
+    def latest(self, maxAge = None):
+        """ This method returns the latest state.
+
+        @param maxAge - float specifying the maximum age in seconds (default: None)
+        @return RobotState or None if there is no state that is young enough
+        """
+        try:
+            state = self._states[-1]
+        except IndexError:
+            return None
+
+        if maxAge is not None and state.age > maxAge:
+            return None
+        return state
+
+
+    def history(self):
+        """ @return list of the buffered states, oldest first """
+        return list(self._states)
+
+
+    def sample(self):
+        """ This method reads the joint angles and stiffnesses with one batched ALMemory.getListData
+            call. ALMemory holds no effector positions, so they take one ALMotion.getPosition call
+            per effector.
+
+        @return RobotState
+        """
+        motionProxy = self.nao.motionProxy
+
+        if self._keys is None:
+            self._joints = motionProxy.getBodyNames('Body')
+            self._keys   = [ StateSampler.AngleKeys[bool(self.useSensors)] % joint
+                             for joint in self._joints ] + \
+                           [ StateSampler.StiffnessKey % joint for joint in self._joints ]
+
+        timestamp   = time.time()
+        values      = self.nao.memoryProxy.getListData(self._keys)
+        angles      = values[:len(self._joints)]
+        stiffnesses = values[len(self._joints):]
+        positions   = dict( (effector, motionProxy.getPosition(effector, self.nao.Frame,
+                                                               self.useSensors))
+                            for effector in StateSampler.Effectors )
+
+        state = RobotState(timestamp, self._joints, angles, stiffnesses, positions)
+        self._states.append(state)
+
+        for listener in list(self.listeners):
+            try:
+                listener(state)
+            except Exception:
+                traceback.print_exc()
+
+        return state
+
+
+    def run(self):
+        next_time = time.time()
+
+        while not self._stopped.is_set():
+            try:
+                self.sample()
+            except Exception:
+                traceback.print_exc()
+
+            next_time = max(next_time + self.period, time.time())
+            self._stopped.wait(next_time - time.time())
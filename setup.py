@@ -43,6 +43,9 @@ setup( name                 = 'pyNAO',
            'setuptools',
            # -*- Extra requirements: -*-
        ],
+       extras_require       = {
+           'async': [ 'trollius' ],
+       },
        entry_points         = """
        # -*- Entry points: -*-
        """,